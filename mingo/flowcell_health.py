@@ -1,16 +1,50 @@
 import argparse
+import asyncio
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 # minknow_api.manager supplies "Manager" a wrapper around MinKNOW's Manager gRPC API with utilities for
 # querying sequencing positions + offline basecalling tools.
 from minknow_api.manager import Manager
 from minknow_api.protocol_pb2 import FilteringInfo
 
+# Upper bound on concurrent gRPC calls
+MAX_WORKERS = 16
+
 
 def to_datetime(date_str):
     if date_str is None:
         return None
-    return datetime.datetime.strptime(date_str, "%Y-%m-%d")
+    try:
+        return datetime.datetime.fromisoformat(date_str)
+    except ValueError:
+        # fromisoformat needs zero-padded dates; strptime also takes e.g. 2024-1-5
+        return datetime.datetime.strptime(date_str, "%Y-%m-%d")
+
+
+async def scan_position(pos, host, filter_info):
+    """Fetch the run info of every pqc protocol run on a position, issuing the lookups concurrently"""
+    pos_connection = await asyncio.to_thread(pos.connect)
+    protocols = await asyncio.to_thread(
+        pos_connection.protocol.list_protocol_runs, filter_info=filter_info
+    )
+    print(f"Searching position {pos.name} on {host} - {len(protocols.run_ids)} protocols")
+    # Get the detailed run info (containing device info and qc results):
+    return await asyncio.gather(*(
+        asyncio.to_thread(pos_connection.protocol.get_run_info, run_id=run_id)
+        for run_id in protocols.run_ids
+    ))
+
+
+async def scan_positions(tasks, filter_info):
+    """Scan all (host, position) pairs at once; failures are returned in place of results"""
+    # minknow_api only has blocking stubs, so each RPC runs on a bounded thread pool while the
+    # event loop pipelines them.
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=MAX_WORKERS))
+    return await asyncio.gather(
+        *(scan_position(pos, host, filter_info) for host, pos in tasks),
+        return_exceptions=True,
+    )
 
 
 def main():
@@ -53,12 +87,25 @@ def main():
     )
 
     args = parser.parse_args()
+    # Checked once per protocol run, so make membership O(1).
+    args.flow_cell_id = set(args.flow_cell_id)
 
     start_date_filter = to_datetime(args.start_date)
     end_date_filter = to_datetime(args.end_date)
 
-    results = {}
+    time_filter = FilteringInfo.TimeFilter()
+    if start_date_filter:
+        time_filter.start_range.FromDatetime(start_date_filter)
+    if end_date_filter:
+        time_filter.end_range.FromDatetime(end_date_filter)
+    filter_info = FilteringInfo(
+        pqc_filter=FilteringInfo.PlatformQcFilter(),
+        experiment_start_time=time_filter,
+    )
 
+    # Gather every running position on every host first, so the slow per-position RPCs can be
+    # issued concurrently below.
+    tasks = []
     for host in args.host:
         try:
             # Construct a manager using the host + port provided.
@@ -66,8 +113,6 @@ def main():
                 host=host, port=args.port, developer_api_token=args.api_token
             )
 
-            # Iterate all sequencing positions:
-            found_position = False
             for pos in manager.flow_cell_positions():
                 if not pos.running:
                     continue
@@ -76,46 +121,40 @@ def main():
                 if args.position and args.position != pos.name:
                     continue
 
-                # Dump all pqc protocols run on the position:
-                found_position = True
-                pos_connection = pos.connect()
-                time_filter = FilteringInfo.TimeFilter()
-                if start_date_filter:
-                    time_filter.start_range.FromDatetime(start_date_filter)
-                if end_date_filter:
-                    time_filter.end_range.FromDatetime(end_date_filter)
-                protocols = pos_connection.protocol.list_protocol_runs(
-                    filter_info=FilteringInfo(
-                        pqc_filter=FilteringInfo.PlatformQcFilter(),
-                        experiment_start_time=time_filter,
-                    )
-                )
-                print(f"Searching position {pos.name} on {host} - {len(protocols.run_ids)} protocols")
-                for run_id in protocols.run_ids:
-                    # Get the detailed run info (containing device info and qc results):
-                    run_info = pos_connection.protocol.get_run_info(run_id=run_id)
-
-                    flow_cell_id = run_info.flow_cell.flow_cell_id or run_info.flow_cell.user_specified_flow_cell_id
-                    if args.flow_cell_id and flow_cell_id not in args.flow_cell_id:
-                        continue
-
-                    # Ignore the protocol if it didn't store a platform qc result:
-                    if run_info.pqc_result:
-                        run_start_time = run_info.start_time.ToDatetime()
-                        
-                        if flow_cell_id not in results or run_start_time > results[flow_cell_id]["timestamp"]:
-                            results[flow_cell_id] = {
-                                "host": host,
-                                "passed": run_info.pqc_result.passed,
-                                "total_pore_count": run_info.pqc_result.total_pore_count,
-                                "position": pos.name,
-                                "product_code": run_info.flow_cell.product_code
-                                or run_info.flow_cell.user_specified_product_code,
-                                "timestamp": run_start_time,
-                            }
+                tasks.append((host, pos))
         except Exception as e:
             print(f"Could not connect to host {host}: {e}")
 
+    results = {}
+
+    # Merge sequentially once everything is gathered, so results needs no locking.
+    scans = asyncio.run(scan_positions(tasks, filter_info))
+    for (host, pos), run_infos in zip(tasks, scans):
+        if isinstance(run_infos, Exception):
+            print(f"Could not read runs from {host} {pos.name}: {run_infos}")
+            continue
+
+        for run_info in run_infos:
+            flow_cell_id = run_info.flow_cell.flow_cell_id or run_info.flow_cell.user_specified_flow_cell_id
+            if args.flow_cell_id and flow_cell_id not in args.flow_cell_id:
+                continue
+
+            # Ignore the protocol if it didn't store a platform qc result:
+            if not run_info.pqc_result:
+                continue
+
+            # Only convert the timestamp for runs that survived both filters.
+            run_start_time = run_info.start_time.ToDatetime()
+            if flow_cell_id not in results or run_start_time > results[flow_cell_id]["timestamp"]:
+                results[flow_cell_id] = {
+                    "host": host,
+                    "passed": run_info.pqc_result.passed,
+                    "total_pore_count": run_info.pqc_result.total_pore_count,
+                    "position": pos.name,
+                    "product_code": run_info.flow_cell.product_code
+                    or run_info.flow_cell.user_specified_product_code,
+                    "timestamp": run_start_time,
+                }
 
     for flow_cell_id, result in results.items():
         print(f"Flow Cell ID: {flow_cell_id}")
@@ -1,88 +1,555 @@
 
+import asyncio
+import atexit
+import functools
 import logging
-from typing import List, Dict, Optional, Sequence
-from minknow_api.manager import Manager
-from minknow_api.protocol_pb2 import BarcodeUserData
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Dict, Optional, Sequence, Tuple
+import grpc
+from minknow_api.manager import FlowCellPosition, Manager
+from minknow_api.protocol_pb2 import BarcodeUserData, ProtocolPhase, ProtocolState
 from minknow_api.protocol_settings_pb2 import ProtocolSetting
+from minknow_api.tools import protocols
+
+try:
+    from .samplesheet import barcode_name
+except ImportError:
+    # Imported as a top-level module, e.g. by run_manager run as a script
+    from samplesheet import barcode_name
 
 
 logger = logging.getLogger(__name__)
 
+# How long (seconds) the flow cell position list is reused before asking the manager again.
+# Unknown names and failed connections trigger an early re-list, so this can be generous.
+POSITIONS_TTL = 30.0
+# How long (seconds) a position connection is reused before it is re-established
+CONNECTION_TTL = 30.0
+# How long (seconds) a position's protocol list is reused; it only changes when scripts are installed
+PROTOCOLS_TTL = 300.0
+# Per-position deadline (seconds) and parallelism for get_positions
+PROBE_TIMEOUT = 3.0
+MAX_PROBE_WORKERS = 16
+# How long (seconds) a finished run's state is trusted without asking MinKNOW again
+FINISHED_STATE_TTL = 60.0
+# Suggested re-poll intervals (seconds), see MinKNOWClient.next_poll_delay
+FAST_POLL = 1.0
+IDLE_POLL = 10.0
+SLOW_POLL = 30.0
+# Backoff (seconds) before re-subscribing to a running position's streams after they break
+WATCH_RETRY_INITIAL = 1.0
+WATCH_RETRY_MAX = 60.0
+
+# States and run phases that usually move on within seconds, so are worth watching closely
+_WAITING_STATES = {
+    "PROTOCOL_WAITING_FOR_TEMPERATURE",
+    "PROTOCOL_WAITING_FOR_ACQUISITION",
+    "PROTOCOL_WAITING_FOR_RESOURCE",
+}
+_TRANSIENT_PHASES = {
+    "PHASE_INITIALISING",
+    "PHASE_PREPARING_FOR_MUX_SCAN",
+    "PHASE_MUX_SCAN",
+    "PHASE_PAUSING",
+    "PHASE_RESUMING",
+}
+# Run states that only change when a new protocol is started
+_FINISHED_STATES = {
+    name for name in ProtocolState.keys()
+    if name in ("PROTOCOL_COMPLETED", "PROTOCOL_STOPPED_BY_USER") or name.startswith("PROTOCOL_FINISHED_")
+}
+
+# Protocol state/phase enum number -> name, and state number -> status shown to users, built once so
+# polling needs no protobuf reflection or string munging per position.
+_STATE_NAMES = {v.number: v.name for v in ProtocolState.DESCRIPTOR.values}
+_PHASE_NAMES = {v.number: v.name for v in ProtocolPhase.DESCRIPTOR.values}
+_STATE_STATUS = {
+    number: "Running" if name == "PROTOCOL_RUNNING"
+    else "Ready" if name == "PROTOCOL_COMPLETED"
+    # Map other states to something readable
+    else name.replace("PROTOCOL_", "").capitalize()
+    for number, name in _STATE_NAMES.items()
+}
+
+def position_status(flow_cell_id: Optional[str], state: Optional[int]) -> str:
+    """
+    Turn a flow cell id and protocol state enum value into the status shown to users.
+    """
+    if not flow_cell_id:
+        return "No Flow Cell"
+    if state is None:
+        return "Ready"
+    return _STATE_STATUS.get(state, "Unknown")
+
+
+@functools.lru_cache(maxsize=64)
+def _barcoding_kits(
+    kit: Optional[str], sample_kit: Optional[str], expansion_kits: Tuple[str, ...], script_kit: Optional[str]
+) -> Tuple[Tuple[str, ...], Optional[str]]:
+    """
+    The barcoding kits for a run and a description of where they came from (None if there are none).
+    """
+    if kit:
+        return (kit,), "explicitly selected barcoding kit"
+    if sample_kit:
+        return (sample_kit,), "barcoding kit from sample sheet"
+    if expansion_kits:
+        return expansion_kits, None
+    if script_kit:
+        return (script_kit,), "barcoding kit from template script tags"
+    return (), None
+
+def resolve_barcoding_kits(
+    kit: Optional[str], sample_kit: Optional[str], expansion_kits: Tuple[str, ...], script_kit: Optional[str]
+) -> Tuple[str, ...]:
+    """
+    Pick the barcoding kits for a run: the kit chosen on the command line, then the kit from the
+    sample sheet, then the template's expansion kits, then the kit in the template's script tags.
+    The lookup is cached, but the choice is logged for every run.
+    """
+    kits, source = _barcoding_kits(kit, sample_kit, expansion_kits, script_kit)
+    if source:
+        logger.info(f"Using {source}: {kits[0]}")
+    return kits
+
+# Manager connections shared by every MinKNOWClient in the process, keyed by (host, port, token).
+# Each Manager holds a TLS channel and made a version check RPC on creation.
+_MANAGER_POOL: Dict[Tuple[str, Optional[int], Optional[str]], Manager] = {}
+_MANAGER_POOL_LOCK = threading.Lock()
+
+def get_manager(host: str = "localhost", port: int = None, token: str = None) -> Manager:
+    """
+    Get the shared Manager for a host, connecting on first use.
+    """
+    key = (host, port, token)
+    with _MANAGER_POOL_LOCK:
+        manager = _MANAGER_POOL.get(key)
+        if manager is None:
+            manager = Manager(host=host, port=port, developer_api_token=token)
+            _MANAGER_POOL[key] = manager
+        return manager
+
+@atexit.register
+def _close_managers():
+    with _MANAGER_POOL_LOCK:
+        for manager in _MANAGER_POOL.values():
+            try:
+                manager.close()
+            except Exception:
+                pass
+        _MANAGER_POOL.clear()
+
+
 class MinKNOWClient:
     def __init__(self, host: str = "localhost", port: int = None, token: str = None):
         self.host = host
         self.port = port
         self.token = token
-        self.manager = Manager(host=host, port=port, developer_api_token=token)
+        self.manager = get_manager(host, port, token)
+        self._positions_cache = None
+        self._positions_ts = 0.0
+        self._connections = {}
+        self._last_state = {}
+        self._protocols_cache = {}
+        # Pushed state, only populated once start_watching() has been called
+        self._watch_lock = threading.RLock()
+        self._watch_thread = None
+        self._watched = {}
+        self._position_watchers = set()
 
-    def get_positions(self) -> List[Dict]:
+    def _positions(self, max_age: float = POSITIONS_TTL) -> Dict:
         """
-        Get all flow cell positions and their states.
+        Get flow cell positions keyed by name, re-listing them only when the cache is stale.
+        An empty list is not reused, as MinKNOW may still be bringing positions up.
         """
-        positions = []
+        now = time.monotonic()
+        # Read and return the cache through a local: refresh() may clear it from another thread meanwhile
+        positions = self._positions_cache
+        if not positions or now - self._positions_ts > max_age:
+            positions = {p.name: p for p in self.manager.flow_cell_positions()}
+            self._positions_cache = positions
+            self._positions_ts = now
+        return positions
+
+    def refresh(self):
+        """
+        Drop the cached position list so the next call re-lists positions.
+        """
+        self._positions_cache = None
+
+    def _get_position(self, name: str):
+        """
+        Look up a flow cell position by name, re-listing once if it is not in the cached list
+        (e.g. a device plugged in since).
+        """
+        positions = self._positions()
+        if name not in positions:
+            positions = self._positions(max_age=0)
+        return positions[name]
+
+    def _get_connection(self, name: str):
+        """
+        Get a connection to a position, reusing the previous one while it is younger than CONNECTION_TTL.
+        Opening a connection costs a channel setup plus a version check RPC, so this is worth keeping.
+        """
+        now = time.monotonic()
+        cached = self._connections.get(name)
+        if cached and now - cached[1] < CONNECTION_TTL:
+            return cached[0]
+        if cached:
+            # Expired rather than failed, so the position list is still good
+            cached[0].channel.close()
+        connection = self._get_position(name).connect()
+        self._connections[name] = (connection, now)
+        return connection
+
+    def _drop_connection(self, name: str):
+        """
+        Close and forget the cached connection for a position, e.g. after an RPC failed on it.
+        The position list is dropped too, as the position may have restarted on a new port.
+        """
+        cached = self._connections.pop(name, None)
+        if cached:
+            cached[0].channel.close()
+            self.refresh()
+
+    def _probe_position(self, pos) -> Dict:
+        """
+        Query a single position for its flow cell and run state.
+        """
+        status = "Ready"
+        flow_cell_id = None
+        fc_info = None
+        
         try:
-            for pos in self.manager.flow_cell_positions():
-                status = "Ready"
-                flow_cell_id = None
-                fc_info = None
-                
-                try:
-                    connection = pos.connect()
-                    
-                    # Check flow cell info
-                    fc_info = connection.device.get_flow_cell_info()
-                    flow_cell_id = fc_info.flow_cell_id
-                    
-                    if not flow_cell_id:
-                        status = "No Flow Cell"
-                    else:
-                        # Check run state
-                        run_info = connection.protocol.get_run_info()
-                        # Use the protocol state enum name for a descriptive status
-                        state_name = connection.protocol._pb.ProtocolState.Name(run_info.state)
-                        if state_name == "PROTOCOL_RUNNING":
-                             status = "Running"
-                        elif state_name == "PROTOCOL_COMPLETED":
-                             status = "Ready"
+            connection = self._get_connection(pos.name)
+            
+            # A finished run stays finished until a new one is started, so a recent terminal state on
+            # the same flow cell can be reused instead of asking again.
+            last = self._last_state.get(pos.name)
+            finished = (
+                last is not None and last[1] in _FINISHED_STATES
+                and time.monotonic() - last[3] < FINISHED_STATE_TTL
+            )
+            
+            run_info_future = None
+            if not finished:
+                # Ask for the run state up front (the stub's future form is non-blocking) so that both
+                # round-trips overlap rather than being paid one after the other.
+                run_info_future = connection.protocol._stub.get_run_info.future(
+                    connection.protocol._pb.GetRunInfoRequest(), timeout=PROBE_TIMEOUT
+                )
+            
+            # Check flow cell info
+            fc_info = connection.device.get_flow_cell_info()
+            flow_cell_id = fc_info.flow_cell_id
+            
+            if not flow_cell_id:
+                if run_info_future is not None:
+                    run_info_future.cancel()
+                self._last_state[pos.name] = (None, None, None, time.monotonic())
+                status = "No Flow Cell"
+            elif finished and flow_cell_id == last[0]:
+                status = position_status(flow_cell_id, ProtocolState.Value(last[1]))
+            else:
+                if run_info_future is None:
+                    run_info_future = connection.protocol._stub.get_run_info.future(
+                        connection.protocol._pb.GetRunInfoRequest(), timeout=PROBE_TIMEOUT
+                    )
+                # Check run state
+                run_info = run_info_future.result()
+                # Use the protocol state enum name for a descriptive status
+                self._last_state[pos.name] = (
+                    flow_cell_id, _STATE_NAMES.get(run_info.state), _PHASE_NAMES.get(run_info.phase),
+                    time.monotonic()
+                )
+                status = position_status(flow_cell_id, run_info.state)
+                 
+        except Exception as e:
+            logger.warning(f"Failed to get details for position {pos.name}: {e}")
+            self._drop_connection(pos.name)
+            self._last_state.pop(pos.name, None)
+            status = "Error/Offline"
+        
+        # Extract product code
+        product_code = "UNKNOWN"
+        if fc_info:
+            product_code = fc_info.product_code or fc_info.user_specified_product_code or "UNKNOWN"
+
+        return {
+            "name": pos.name,
+            "status": status,
+            "running": status == "Running",
+            "flow_cell_id": flow_cell_id,
+            "product_code": product_code  
+        }
+
+    def start_watching(self):
+        """
+        Follow positions through MinKNOW's streaming RPCs instead of polling them.
+        Once every position has reported in, get_positions answers from the pushed state without any RPCs.
+        """
+        with self._watch_lock:
+            if self._watch_thread is not None:
+                return
+            self._watch_thread = threading.Thread(
+                target=self._watch_manager, name="minknow-positions", daemon=True
+            )
+            self._watch_thread.start()
+
+    def _watch_manager(self):
+        """
+        Track positions appearing, changing and disappearing, starting a watcher for each running one.
+        Positions that are not running are reported offline, as polling would report them.
+        """
+        try:
+            for update in self.manager.rpc.watch_flow_cell_positions():
+                for description in [*update.additions, *update.changes]:
+                    pos = FlowCellPosition(description, host=self.manager.host, credentials=self.manager.credentials)
+                    with self._watch_lock:
+                        if not pos.running:
+                            self._watched[pos.name] = {
+                                "flow_cell_info": None, "state": None, "state_known": False, "error": True,
+                                "running": False, "position": pos,
+                            }
+                        elif pos.name in self._position_watchers:
+                            # The watcher picks up the new description (e.g. a new port) when it next connects
+                            self._watched[pos.name].update(running=True, position=pos)
                         else:
-                             # Map other states to something readable
-                             status = state_name.replace("PROTOCOL_", "").capitalize()
-                         
-                except Exception as e:
-                    logger.warning(f"Failed to get details for position {pos.name}: {e}")
+                            self._watched[pos.name] = {
+                                "flow_cell_info": None, "state": None, "state_known": False, "error": False,
+                                "running": True, "position": pos,
+                            }
+                            self._position_watchers.add(pos.name)
+                            threading.Thread(
+                                target=self._watch_position, args=(pos.name,), name=f"minknow-{pos.name}", daemon=True
+                            ).start()
+                for name in update.removals:
+                    with self._watch_lock:
+                        self._watched.pop(name, None)
+        except Exception as e:
+            logger.error(f"Stopped watching flow cell positions: {e}")
+        with self._watch_lock:
+            # get_positions goes back to polling
+            self._watch_thread = None
+            self._watched.clear()
+
+    def _watch_position(self, name: str):
+        """
+        Follow one position's flow cell and protocol run streams. When they break, the position is shown
+        as offline and the streams are re-subscribed with backoff, for as long as it is listed and running.
+        """
+        delay = WATCH_RETRY_INITIAL
+        while True:
+            with self._watch_lock:
+                watched = self._watched.get(name)
+                if watched is None or not watched["running"]:
+                    self._position_watchers.discard(name)
+                    return
+                pos = watched["position"]
+            try:
+                # A dedicated connection: long-lived streams must not sit on a cached connection that gets recycled.
+                connection = pos.connect()
+                try:
+                    threading.Thread(
+                        target=self._watch_flow_cell, args=(name, connection), name=f"minknow-{name}-fc", daemon=True
+                    ).start()
+                    # The run stream says nothing until a protocol starts if there is no current run,
+                    # so seed the state from the latest run (if there has been one) first
+                    try:
+                        self._record_run(name, connection.protocol.get_run_info())
+                    except grpc.RpcError:
+                        self._record_run(name, None)
+                    with self._watch_lock:
+                        if name in self._watched:
+                            self._watched[name]["error"] = False
+                    delay = WATCH_RETRY_INITIAL
+                    for run_info in connection.protocol.watch_current_protocol_run():
+                        self._record_run(name, run_info)
+                finally:
+                    # Ends the flow cell stream too, so the next attempt starts both afresh
+                    connection.channel.close()
+                logger.info(f"Protocol run stream on position {name} ended, re-subscribing in {delay:.0f}s")
+            except Exception as e:
+                logger.warning(f"Lost watch on position {name}, re-subscribing in {delay:.0f}s: {e}")
+                with self._watch_lock:
+                    if name in self._watched:
+                        self._watched[name]["error"] = True
+            time.sleep(delay)
+            delay = min(delay * 2, WATCH_RETRY_MAX)
+
+    def _record_run(self, name: str, run_info):
+        """
+        Store a position's pushed protocol run state; None means no protocol has run on it yet.
+        """
+        state = run_info.state if run_info is not None else None
+        with self._watch_lock:
+            if name in self._watched:
+                self._watched[name]["state"] = state
+                self._watched[name]["state_known"] = True
+        if run_info is not None:
+            self._last_state[name] = (
+                run_info.flow_cell.flow_cell_id or None, _STATE_NAMES.get(run_info.state),
+                _PHASE_NAMES.get(run_info.phase), time.monotonic()
+            )
+
+    def _watch_flow_cell(self, name: str, connection):
+        """
+        Keep a position's flow cell info current from the flow cell info stream.
+        If the stream breaks, the connection is closed so _watch_position re-subscribes to both streams.
+        """
+        try:
+            for fc_info in connection.device.stream_flow_cell_info():
+                with self._watch_lock:
+                    if name in self._watched:
+                        self._watched[name]["flow_cell_info"] = fc_info
+        except Exception as e:
+            logger.debug(f"Flow cell stream on position {name} ended: {e}")
+        connection.channel.close()
+
+    def _watched_positions(self) -> Optional[List[Dict]]:
+        """
+        Build get_positions output from pushed state, or None if the streams have not all reported yet.
+        """
+        with self._watch_lock:
+            if self._watch_thread is None or not self._watched:
+                return None
+            if any(
+                (w["flow_cell_info"] is None or not w["state_known"]) and not w["error"]
+                for w in self._watched.values()
+            ):
+                return None
+            positions = []
+            for name, watched in self._watched.items():
+                fc_info = watched["flow_cell_info"]
+                if watched["error"]:
                     status = "Error/Offline"
-                
-                # Extract product code
+                    flow_cell_id = None
+                else:
+                    flow_cell_id = fc_info.flow_cell_id
+                    status = position_status(flow_cell_id, watched["state"])
                 product_code = "UNKNOWN"
                 if fc_info:
                     product_code = fc_info.product_code or fc_info.user_specified_product_code or "UNKNOWN"
-
                 positions.append({
-                    "name": pos.name,
+                    "name": name,
                     "status": status,
                     "running": status == "Running",
                     "flow_cell_id": flow_cell_id,
-                    "product_code": product_code  
+                    "product_code": product_code
                 })
+            return positions
+
+    def get_positions(self) -> List[Dict]:
+        """
+        Get all flow cell positions and their states.
+        Positions are queried in parallel; one that does not answer within PROBE_TIMEOUT is reported as offline.
+        After start_watching() this is served from the streamed state instead.
+        """
+        watched = self._watched_positions()
+        if watched is not None:
+            return watched
+
+        try:
+            positions_list = list(self._positions().values())
         except Exception as e:
             logger.error(f"Failed to list positions: {e}")
+            return []
+
+        if not positions_list:
+            return []
+
+        positions = []
+        # Not used as a context manager: leaving the block would wait on any hung probe.
+        executor = ThreadPoolExecutor(max_workers=min(MAX_PROBE_WORKERS, len(positions_list)))
+        try:
+            futures = [executor.submit(self._probe_position, pos) for pos in positions_list]
+            for pos, future in zip(positions_list, futures):
+                try:
+                    positions.append(future.result(timeout=PROBE_TIMEOUT))
+                except TimeoutError:
+                    logger.warning(f"Timed out getting details for position {pos.name}")
+                    positions.append({
+                        "name": pos.name,
+                        "status": "Error/Offline",
+                        "running": False,
+                        "flow_cell_id": None,
+                        "product_code": "UNKNOWN"
+                    })
+        finally:
+            executor.shutdown(wait=False)
             
         return positions
 
+    def next_poll_delay(self, position_name: str) -> float:
+        """
+        Suggest how long to wait before polling a position again, based on what get_positions last saw.
+        Waiting states and start-up/mux scan/pause transitions are polled quickly, steady sequencing slowly.
+        """
+        last = self._last_state.get(position_name)
+        if last is None:
+            return IDLE_POLL
+        _, state_name, phase_name, _ = last
+        if state_name in _WAITING_STATES or phase_name in _TRANSIENT_PHASES:
+            return FAST_POLL
+        if state_name == "PROTOCOL_RUNNING":
+            return SLOW_POLL
+        return IDLE_POLL
+
     def list_protocols(self, position_name: str) -> List[str]:
         """
         List available protocols for a position.
+        Results are reused for PROTOCOLS_TTL seconds; failures are not cached.
         """
+        cached = self._protocols_cache.get(position_name)
+        if cached and time.monotonic() - cached[0] < PROTOCOLS_TTL:
+            return list(cached[1])
         try:
-            pos = next(p for p in self.manager.flow_cell_positions() if p.name == position_name)
-            connection = pos.connect()
+            connection = self._get_connection(position_name)
             # Use the .protocols field from the response
             response = connection.protocol.list_protocols()
-            return [p.identifier for p in response.protocols]
+            identifiers = [p.identifier for p in response.protocols]
+            self._protocols_cache[position_name] = (time.monotonic(), identifiers)
+            return list(identifiers)
         except Exception as e:
             logger.error(f"Failed to list protocols for {position_name}: {e}")
+            self._drop_connection(position_name)
             return []
 
+    def snapshot_position(self, position_name: str) -> Dict:
+        """
+        Get a position's flow cell, run state and protocol list together, over one connection.
+        Returns the same fields as get_positions plus "protocols" (empty if the position is offline).
+        """
+        try:
+            pos = self._get_position(position_name)
+        except Exception as e:
+            logger.error(f"Failed to find position {position_name}: {e}")
+            return {
+                "name": position_name,
+                "status": "Error/Offline",
+                "running": False,
+                "flow_cell_id": None,
+                "product_code": "UNKNOWN",
+                "protocols": []
+            }
+        snapshot = self._probe_position(pos)
+        # The probe leaves its connection cached (or dropped on failure), so this adds no channel setup
+        snapshot["protocols"] = [] if snapshot["status"] == "Error/Offline" else self.list_protocols(position_name)
+        return snapshot
+
+    def invalidate_protocols(self, position_name: str = None):
+        """
+        Forget cached protocol lists (for one position, or all of them), e.g. after installing scripts.
+        """
+        if position_name is None:
+            self._protocols_cache.clear()
+        else:
+            self._protocols_cache.pop(position_name, None)
+
     def start_run(self, position_name: str, protocol_id: str, sample_sheet_path: str, run_name: str = None, settings: dict = None, samples: list = None, kit: str = None):
         """
         Start a protocol on a specific position.
@@ -96,8 +563,6 @@ class MinKNOWClient:
             samples: List of sample dictionaries from SLIMS
             kit: Explicitly selected barcoding kit (e.g. SQK-RBK114-96)
         """
-        from minknow_api.tools import protocols
-        
         if not settings:
             settings = {}
             
@@ -106,64 +571,33 @@ class MinKNOWClient:
         if settings is None:
             settings = {}
             
-        barcode_user_info = []
         if samples:
             logger.info(f"Mapping {len(samples)} samples to barcode info")
-            for sample in samples:
-                user_data = BarcodeUserData()
-                user_data.alias = sample.get('cntn_id', '')
-                user_data.type = BarcodeUserData.SampleType.test_sample
-                
-                barcode_i7 = sample.get('barcode_i7', '')
-                if barcode_i7:
-                    # Map NB01/BC01 to barcode01 etc.
-                    if barcode_i7[:2] in ['NB', 'BC']:
-                        try:
-                            idx = int(barcode_i7[2:])
-                            user_data.barcode_name = f"barcode{idx:02d}"
-                        except ValueError:
-                            user_data.barcode_name = barcode_i7
-                    else:
-                        user_data.barcode_name = barcode_i7
-                
-                barcode_user_info.append(user_data)
-                
+        barcode_user_info = [
+            BarcodeUserData(
+                alias=sample.get('cntn_id', ''),
+                type=BarcodeUserData.SampleType.test_sample,
+                barcode_name=barcode_name(sample.get('barcode_i7') or '', sample.get('barcode_i7') or ''),
+            )
+            for sample in samples or ()
+        ]
+
         try:
-            pos = next(p for p in self.manager.flow_cell_positions() if p.name == position_name)
-            connection = pos.connect()
+            connection = self._get_connection(position_name)
             
             # 1. Basecalling & Barcoding & Alignment
             barcoding_args = None
             if settings.get("barcodingEnabled"):
-                # Extract kit from samples if available, otherwise fallback to settings
-                barcoding_kits = settings.get("barcodingExpansionKits", [])
-                
-                # Priority 1: Explicitly selected kit (from CLI)
-                if kit:
-                     logger.info(f"Using explicitly selected barcoding kit: {kit}")
-                     barcoding_kits = [kit]
-                else:
-                    # Priority 2: Extract from samples (SLIMS data)
-                    if samples and len(samples) > 0:
-                        # In SLIMS, the kit is often in 'kit' or 'cntn_cf_kit'
-                        # We'll check the first sample as all should be the same for a run position
-                        first_sample = samples[0]
-                        if logger.isEnabledFor(logging.DEBUG):
-                            pass # Kept structure if needed, or just remove.
-                            # logger.debug(f"DEBUG: First sample keys: ...") 
-                        
-                        # Attempt to find kit in likely fields
-                        sample_kit = first_sample.get('kit') or first_sample.get('cntn_cf_kit')
-                        if sample_kit:
-                            logger.info(f"Using barcoding kit from sample sheet: {sample_kit}")
-                            barcoding_kits = [sample_kit]
-                    
-                    # Priority 3: Fallback to template tags
-                    if not barcoding_kits:
-                         script_kit = settings.get("script", {}).get("tags", {}).get("kit")
-                         if script_kit:
-                             logger.info(f"Using barcoding kit from template script tags: {script_kit}")
-                             barcoding_kits = [script_kit]
+                sample_kit = None
+                if samples:
+                    # In SLIMS, the kit is often in 'kit' or 'cntn_cf_kit'; all samples on a position share it
+                    sample_kit = samples[0].get('kit') or samples[0].get('cntn_cf_kit')
+                barcoding_kits = list(resolve_barcoding_kits(
+                    kit,
+                    sample_kit,
+                    tuple(settings.get("barcodingExpansionKits", [])),
+                    settings.get("script", {}).get("tags", {}).get("kit"),
+                ))
 
                 barcoding_args = protocols.BarcodingArgs(
                     kits=barcoding_kits,
@@ -211,28 +645,27 @@ class MinKNOWClient:
             )
 
             # 6. Simulation Path (needs to be a Path object)
-            from pathlib import Path
             sim_path = settings.get("simulatedPlaybackFilePath")
             if sim_path:
                 sim_path = Path(sim_path)
 
             if logger.isEnabledFor(logging.DEBUG):
                 logger.debug("--- Protocol Parameters ---")
-                logger.debug(f"Position: {position_name}")
-                logger.debug(f"Protocol ID: {protocol_id}")
-                logger.debug(f"Run Name: {run_name}")
-                logger.debug(f"Basecalling: {basecalling_args}")
-                logger.debug(f"Barcoding: {barcoding_args}")
-                logger.debug(f"Alignment: {alignment_args}")
-                logger.debug(f"Read Until: None")
-                logger.debug(f"Output: FASTQ={fastq_args}, POD5={pod5_args}, BAM={bam_args}")
-                logger.debug(f"Duration: {duration_hours}h")
-                logger.debug(f"Extra Args: None")
-                logger.debug(f"Simulation Path: {sim_path}")
+                logger.debug("Position: %s", position_name)
+                logger.debug("Protocol ID: %s", protocol_id)
+                logger.debug("Run Name: %s", run_name)
+                logger.debug("Basecalling: %s", basecalling_args)
+                logger.debug("Barcoding: %s", barcoding_args)
+                logger.debug("Alignment: %s", alignment_args)
+                logger.debug("Read Until: None")
+                logger.debug("Output: FASTQ=%s, POD5=%s, BAM=%s", fastq_args, pod5_args, bam_args)
+                logger.debug("Duration: %sh", duration_hours)
+                logger.debug("Extra Args: None")
+                logger.debug("Simulation Path: %s", sim_path)
                 if barcode_user_info:
-                    logger.debug(f"Barcode Info Map ({len(barcode_user_info)} barcodes):")
+                    logger.debug("Barcode Info Map (%d barcodes):", len(barcode_user_info))
                     for b in barcode_user_info:
-                        logger.debug(f"  - {b.alias} -> {b.barcode_name}")
+                        logger.debug("  - %s -> %s", b.alias, b.barcode_name)
                 logger.debug("---------------------------")
 
             logger.info(f"Starting protocol {protocol_id} on {position_name} using standard tools")
@@ -260,14 +693,43 @@ class MinKNOWClient:
                     "--poly_a_tail_length_estimation=off",
                     ]
             )
+            # The position is no longer in whatever state it finished in
+            self._last_state.pop(position_name, None)
             
             return run_id
             
         except Exception as e:
             logger.error(f"Failed to start run on {position_name}: {e}")
+            self._drop_connection(position_name)
             raise
 
 
+    async def start_runs(self, specs: List[Dict]) -> List:
+        """
+        Start runs on several positions concurrently, e.g. every position on a GridION.
+        Each spec holds start_run's keyword arguments. Results come back in spec order; a run that
+        failed to start gives its exception instead of a run id, so one bad position does not hide the rest.
+        """
+        # minknow_api only ships blocking stubs, so each start_run gets its own worker thread
+        return await asyncio.gather(
+            *(asyncio.to_thread(self.start_run, **spec) for spec in specs), return_exceptions=True
+        )
+
+    def start_runs_sync(self, specs: List[Dict]) -> List:
+        """
+        Blocking wrapper around start_runs for callers without an event loop.
+        """
+        return asyncio.run(self.start_runs(specs))
+
+# ProtocolSettingValue field for each supported Python type, looked up by exact type
+_SETTING_FIELDS = {
+    bool: "bool_value",
+    int: "integer_value",
+    float: "float_value",
+    str: "string_value",
+}
+
+
 def to_protocol_setting_value(value):
     """Converts a Python value to a ProtocolSettingValue message.
 
@@ -278,16 +740,13 @@ def to_protocol_setting_value(value):
         minknow_api.protocol_settings_pb2.ProtocolSetting.ProtocolSettingValue: The converted value.
     """
     val = ProtocolSetting.ProtocolSettingValue()
-    if isinstance(value, bool):
-        val.bool_value = value
-    elif isinstance(value, int):
-        val.integer_value = value
-    elif isinstance(value, float):
-        val.float_value = value
-    elif isinstance(value, str):
-        val.string_value = value
-    else:
-        raise ValueError(f"Unsupported protocol setting value type: {type(value)}")
+    field = _SETTING_FIELDS.get(type(value))
+    if field is None:
+        # Subclasses (e.g. an IntEnum) miss the exact-type lookup; bool is listed before int
+        field = next((f for t, f in _SETTING_FIELDS.items() if isinstance(value, t)), None)
+        if field is None:
+            raise ValueError(f"Unsupported protocol setting value type: {type(value)}")
+    setattr(val, field, value)
     return val
 
 
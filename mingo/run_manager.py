@@ -2,20 +2,39 @@
 import os
 import sys
 import argparse
+import copy
+import functools
 import logging
 import json
-import glob
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
 
+# orjson is optional: it parses and dumps JSON several times faster than the standard library
 try:
-    from slims import SlimsClient
-    from samplesheet import SampleSheetGenerator
-    from minknow_utils import MinKNOWClient
+    import orjson
+
+    def _loads(data):
+        return orjson.loads(data)
+
+    def _dumps(obj):
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+except ImportError:
+    def _loads(data):
+        return json.loads(data)
+
+    def _dumps(obj):
+        return json.dumps(obj, indent=2)
+
+# slims and minknow_utils pull in requests and gRPC, so they are only imported in main() when
+# talking to real systems; --help and --mock do without them.
+try:
+    from samplesheet import SampleSheetGenerator, barcode_name, barcode_number
 except ImportError:
     # Ensure local modules can be imported if running from same directory
     sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-    from slims import SlimsClient
-    from samplesheet import SampleSheetGenerator
-    from minknow_utils import MinKNOWClient
+    from samplesheet import SampleSheetGenerator, barcode_name, barcode_number
 
 # Mock Classes
 class MockSlimsClient:
@@ -26,6 +45,8 @@ class MockSlimsClient:
             {"pk": 1, "xprn_name": "MOCK_RUN_01", "xprn_status": "Ready"},
             {"pk": 2, "xprn_name": "MOCK_RUN_02", "xprn_status": "Ready"}
         ]
+    def fetch_run_details_batch(self, run_pks):
+        return {pk: self.fetch_run_details(pk) for pk in run_pks}
     def fetch_run_details(self, run_pk):
         return {
             "run": {"pk": run_pk, "xprn_name": f"MOCK_RUN_{run_pk:02d}"},
@@ -52,8 +73,10 @@ class MockMinKNOWClient:
             {"name": "1B", "status": "Running", "running": True, "flow_cell_id": "SIM_MOCK_2", "product_code": "FLO-PRO114"}
         ]
 
-    def start_run(self, position_name, protocol_id, sample_sheet_path, run_name, settings=None, samples=None):
+    def start_run(self, position_name, protocol_id, sample_sheet_path, run_name, settings=None, samples=None, kit=None):
         print(f"[MOCK] Started run {run_name} on {position_name} using {protocol_id}")
+        if kit:
+            print(f"[MOCK] Barcoding Kit: {kit}")
         if settings:
             print(f"[MOCK] Applied settings from template: {settings.get('script', {}).get('name', 'custom')}")
             if settings.get('customBarcodesSelection'):
@@ -63,22 +86,179 @@ class MockMinKNOWClient:
              print(f"[MOCK] Barcoding Kits: {settings['barcodingExpansionKits']}")
  
         if samples:
-            print(f"[MOCK] Barcode Info Mapping ({len(samples)} samples):")
+            lines = [f"[MOCK] Barcode Info Mapping ({len(samples)} samples):"]
             for sample in samples:
-                alias = sample.get('cntn_id', '')
-                barcode = sample.get('barcode_i7', '')
-                barcode_name = barcode
-                if barcode and barcode[:2] in ['NB', 'BC']:
-                    try:
-                        idx = int(barcode[2:])
-                        barcode_name = f"barcode{idx:02d}"
-                    except ValueError:
-                        pass
-                print(f"   - {alias} -> {barcode_name}")
+                barcode = sample.get('barcode_i7') or ''
+                lines.append(f"   - {sample.get('cntn_id', '')} -> {barcode_name(barcode, barcode)}")
+            print("\n".join(lines))
              
         # Show full settings in mock if debug is on
         if logging.getLogger().isEnabledFor(logging.DEBUG):
-            print(f"[DEBUG][MOCK] Full Protocol Settings: {json.dumps(settings, indent=2)}")
+            print(f"[DEBUG][MOCK] Full Protocol Settings: {_dumps(settings)}")
+
+# On-disk cache of SLIMS responses, so re-running straight after a mistake skips the SLIMS round-trips
+CACHE_FILE = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'mingo', 'slims.json')
+# How long (seconds) cached responses are used: the queued run list changes often, run details rarely
+QUEUED_RUNS_TTL = 30
+RUN_DETAILS_TTL = 300
+# Entries older than this are dropped from the cache file
+CACHE_MAX_AGE = 24 * 3600
+# Serializes read-modify-write of the cache file between the main and background threads
+_CACHE_LOCK = threading.Lock()
+
+def _load_cache():
+    try:
+        with open(CACHE_FILE, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_cache(cache):
+    now = time.time()
+    cache = {k: v for k, v in cache.items() if now - v[0] < CACHE_MAX_AGE}
+    try:
+        # SLIMS data includes customer sample and order names, so only the user may read it
+        os.makedirs(os.path.dirname(CACHE_FILE), mode=0o700, exist_ok=True)
+        # A tmp file of its own (mkstemp creates it 0600), so concurrent writers never write into each other's file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(CACHE_FILE), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(cache, f)
+            os.replace(tmp_path, CACHE_FILE)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError as e:
+        logging.debug(f"Could not write cache {CACHE_FILE}: {e}")
+
+def _update_cache(entries):
+    """
+    Add entries to the cache file, keeping whatever other writers have stored meanwhile.
+    """
+    with _CACHE_LOCK:
+        cache = _load_cache()
+        cache.update(entries)
+        _save_cache(cache)
+
+def cached_fetch(key, ttl, fetch, *args):
+    """
+    Return fetch(*args), reusing a result cached on disk under key for up to ttl seconds.
+    If fetch fails, the last cached result is used however old it is. A key of None disables caching.
+    Empty results are returned but not cached, so they never replace the last good entry.
+    """
+    if key is None:
+        return fetch(*args)
+    entry = _load_cache().get(key)
+    if entry and time.time() - entry[0] < ttl:
+        logging.debug(f"Using cached SLIMS response for {key}")
+        return entry[1]
+    try:
+        payload = fetch(*args)
+    except Exception as e:
+        if entry is None:
+            raise
+        print(f"!! Warning: SLIMS request failed ({e}), using cached data from {time.ctime(entry[0])}")
+        return entry[1]
+    if payload:
+        _update_cache({key: (time.time(), payload)})
+    return payload
+
+def run_details_key(cache_url, run_pk):
+    return cache_url and f"{cache_url} run_details {run_pk}"
+
+def fetch_run_details_cached(slims, cache_url, run_pks):
+    """
+    Fetch details for several runs in one batch, keyed by run pk. Shares cached_fetch's per-run
+    cache entries, so fresh ones are reused and a single-run fetch later finds what the batch got.
+    """
+    details = {}
+    if cache_url:
+        cache = _load_cache()
+        for pk in run_pks:
+            entry = cache.get(run_details_key(cache_url, pk))
+            if entry and time.time() - entry[0] < RUN_DETAILS_TTL:
+                details[pk] = entry[1]
+    fetched = slims.fetch_run_details_batch([pk for pk in run_pks if pk not in details])
+    details.update(fetched)
+    if cache_url and fetched:
+        _update_cache({run_details_key(cache_url, pk): (time.time(), d) for pk, d in fetched.items() if d})
+    return details
+
+def in_background(fn, *args) -> Future:
+    """
+    Start fn(*args) on a daemon thread and return a Future for its result.
+    Unlike an executor's workers, the thread never holds up exiting if its result is not needed.
+    """
+    future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+# Write buffer (bytes) for sample sheets; a 96-sample sheet is around 20KB
+SAMPLE_SHEET_BUFFER = 1 << 16
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+
+@functools.lru_cache(maxsize=1)
+def _list_templates(template_dir=TEMPLATE_DIR):
+    try:
+        with os.scandir(template_dir) as entries:
+            return tuple(sorted(e.path for e in entries if e.name.endswith('.json') and e.is_file()))
+    except FileNotFoundError:
+        return ()
+
+@functools.lru_cache(maxsize=32)
+def _read_template(path, mtime):
+    with open(path, 'rb') as f:
+        return _loads(f.read())
+
+def load_template(path):
+    """
+    Load a settings template, parsing it again only if the file has changed.
+    Returns a copy, as callers add run-specific settings to it.
+    """
+    return copy.deepcopy(_read_template(path, os.stat(path).st_mtime))
+
+def _poll(fn, *args, initial=0.25, max_interval=5.0, timeout=30.0):
+    """
+    Call fn(*args) until it returns something non-empty, e.g. while MinKNOW is still starting up.
+    Retries start quick then slow down, doubling the wait up to max_interval. After timeout seconds
+    the last result is returned as it is (None if the last call raised).
+    """
+    deadline = time.monotonic() + timeout
+    interval = initial
+    while True:
+        try:
+            result = fn(*args)
+            if result:
+                return result
+            reason = "nothing found"
+        except Exception as e:
+            result = None
+            reason = str(e)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return result
+        delay = min(interval, remaining)
+        logging.info(f"{fn.__name__}: {reason}, retrying in {delay:.2f}s (giving up in {remaining:.0f}s)")
+        time.sleep(delay)
+        interval = min(interval * 2, max_interval)
+
+def print_menu(title, entries):
+    """
+    Print a title (if any) followed by numbered entries, in a single write.
+    """
+    lines = [title] if title else []
+    lines.extend(f" - {idx + 1}) {entry}" for idx, entry in enumerate(entries))
+    print("\n".join(lines))
 
 def get_input(prompt, options=None):
     while True:
@@ -97,15 +277,17 @@ def main():
     parser.add_argument("--port", type=int, default=None, help="MinKNOW port (optional)")
     parser.add_argument("-d", "--debug", action="store_true", help="Enable debug logging and show detailed protocol parameters.")
     parser.add_argument("--start-run", action="store_true", help="Proceed to configure and start the MinKNOW run.")
+    parser.add_argument("--no-cache", action="store_true", help="Always query SLIMS instead of reusing recent responses.")
     args = parser.parse_args()
 
     # Configure logging
     log_level = logging.DEBUG if args.debug else logging.INFO
     logging.basicConfig(level=log_level, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     
-    # Also update the logger in minknow_utils if it was already initialized
-    from minknow_utils import logger as minknow_logger
-    minknow_logger.setLevel(log_level)
+    if not args.mock:
+        # Also update the logger in minknow_utils if it was already initialized
+        from minknow_utils import logger as minknow_logger
+        minknow_logger.setLevel(log_level)
 
     print("\n--- ONT Run Manager ---\n")
     
@@ -124,21 +306,35 @@ def main():
             print("Please set SLIMS_URL, SLIMS_USER, and SLIMS_PASSWORD.")
             sys.exit(1)
 
+        from slims import SlimsClient
         slims = SlimsClient(slims_url, slims_user, slims_pass)
+
+    # Cache keys include the SLIMS URL so different instances never share entries
+    cache_url = None if args.mock or args.no_cache else slims.url
+
+    # Lookups are started in the background as soon as they are determinable, and only waited on
+    # when needed, so they overlap with each other and with the user answering prompts.
+    # The queued run list does not depend on any answer: fetch it while MinKNOW is contacted
+    # and the position/kit prompts are answered.
+    queued_runs_future = in_background(
+        cached_fetch, cache_url and f"{cache_url} queued_runs", QUEUED_RUNS_TTL, slims.fetch_queued_runs
+    )
+
+    if not args.mock:
+        from minknow_utils import MinKNOWClient
         minknow = MinKNOWClient(host=args.host, port=args.port) # Use provided host/port
 
     # 2. Select Position
     print("Checking sequencer positions...")
-    positions = minknow.get_positions()
+    positions = _poll(minknow.get_positions)
     if not positions:
         print("No sequencing positions found. Ensure MinKNOW is running.")
         sys.exit(1)
         
-    print(f"\nFound {len(positions)} positions:")
-    for idx, pos in enumerate(positions):
-        status = pos.get('status', 'Unknown')
-        fc_id = pos.get('flow_cell_id', 'Unknown')
-        print(f" - {idx + 1}) {pos['name']}, Flowcell ID: {fc_id}, Status: {status}")
+    print_menu(f"\nFound {len(positions)} positions:", (
+        f"{pos['name']}, Flowcell ID: {pos.get('flow_cell_id', 'Unknown')}, Status: {pos.get('status', 'Unknown')}"
+        for pos in positions
+    ))
 
     while True:
         pos_choice = get_input("Please confirm which position the library is loaded into (number) or type 'q' to quit:", 
@@ -152,15 +348,18 @@ def main():
             print(f"!! Error: Position {selected_pos['name']} is already running a protocol. Please choose an idle position.")
             continue
         break
+
+    protocols_future = None
+    if args.start_run and not args.mock:
+        # Only needed if the chosen template names no protocol, but it is cached and cheap to get now
+        protocols_future = in_background(_poll, minknow.list_protocols, selected_pos['name'])
     
     # 3. Select Kit
-    print("\nAvailable Kits:")
     kits = [
         {"name": "RAPID 96", "code": "SQK-RBK114-96"},
         {"name": "NATIVE 96", "code": "SQK-NBD114-96"}
     ]
-    for idx, kit in enumerate(kits):
-        print(f" - {idx + 1}) {kit['name']} - {kit['code']}")
+    print_menu("\nAvailable Kits:", (f"{kit['name']} - {kit['code']}" for kit in kits))
         
     kit_choice = get_input("Which kit does this run use? (number) or 'q' to quit:", 
                           options=[str(i+1) for i in range(len(kits))] + ['q'])
@@ -172,14 +371,20 @@ def main():
 
     # 4. Select SLIMS Run
     print("\nFetching queued runs from SLIMS...")
-    queued_runs = slims.fetch_queued_runs()
+    try:
+        queued_runs = queued_runs_future.result()
+    except Exception as e:
+        print(f"Error fetching runs from SLIMS: {e}")
+        sys.exit(1)
     
     if not queued_runs:
         print("No queued runs found in SLIMS.")
         sys.exit(0)
+
+    # Get every listed run's details in one batch while the user picks one
+    details_future = in_background(fetch_run_details_cached, slims, cache_url, [r['pk'] for r in queued_runs])
         
-    for idx, run in enumerate(queued_runs):
-        print(f" - {idx + 1}) {run.get('xprn_name', 'Unnamed Run')} (Experiment ID: {run.get('pk')})")
+    print_menu(None, (f"{run.get('xprn_name', 'Unnamed Run')} (Experiment ID: {run.get('pk')})" for run in queued_runs))
         
     run_choice = get_input("Please choose a run (number) or 'q' to quit:", 
                           options=[str(i+1) for i in range(len(queued_runs))] + ['q'])
@@ -191,45 +396,54 @@ def main():
     
     # 5. Fetch Run Details & Generate Sample Sheet
     print(f"\nFetching details for run: {selected_run.get('xprn_name')}...")
-    details = slims.fetch_run_details(selected_run['pk'])
+    details = None
+    if details_future.done() and details_future.exception() is None:
+        details = details_future.result().get(selected_run['pk'])
+    if details is None:
+        # The batch is still going (or failed): fetching the one run is quicker than waiting for all of them
+        try:
+            details = cached_fetch(
+                run_details_key(cache_url, selected_run['pk']), RUN_DETAILS_TTL,
+                slims.fetch_run_details, selected_run['pk']
+            )
+        except Exception as e:
+            print(f"Error fetching run details from SLIMS: {e}")
+            sys.exit(1)
     samples = details['inputs']
     
     print(f" - Found {len(samples)} samples.")
     
-    generator = SampleSheetGenerator()
-    csv_content = generator.generate(
-        run_metadata=selected_run,
-        samples=samples,
-        flow_cell_id=selected_pos.get('flow_cell_id', 'UNKNOWN_FC'),
-        position_id=selected_pos['name'],
-        kit=selected_kit['code'],
-        flow_cell_product_code=selected_pos.get('product_code', 'UNKNOWN_PC')
-    )
-    
     # Save sample sheet
     run_name = selected_run.get('xprn_name', 'run')
     filename = f"{run_name}.csv"
     filepath = os.path.abspath(filename)
     
     print(f" - Writing sample sheet to {filepath}")
-    with open(filepath, 'w') as f:
-        f.write(csv_content)
+    generator = SampleSheetGenerator()
+    # UTF-8 regardless of locale (units such as ng/μl are not ASCII), buffered so the sheet goes out in one write
+    with open(filepath, 'w', newline='', encoding='utf-8', buffering=SAMPLE_SHEET_BUFFER) as f:
+        generator.generate_to(
+            f,
+            run_metadata=selected_run,
+            samples=samples,
+            flow_cell_id=selected_pos.get('flow_cell_id', 'UNKNOWN_FC'),
+            position_id=selected_pos['name'],
+            kit=selected_kit['code'],
+            flow_cell_product_code=selected_pos.get('product_code', 'UNKNOWN_PC')
+        )
         
     if not args.start_run:
         print("\nSample sheet generated. (Use --start-run to proceed with MinKNOW protocol autostart.)")
         return
 
     # 6. Select Settings Template
-    print("\nSettings Templates:")
-    template_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
-    template_files = glob.glob(os.path.join(template_dir, "*.json"))
+    template_files = _list_templates()
     
     if not template_files:
-        print(f" - No templates found in {template_dir}. Using defaults.")
+        print(f"\nSettings Templates:\n - No templates found in {TEMPLATE_DIR}. Using defaults.")
         selected_settings = {}
     else:
-        for idx, fpath in enumerate(template_files):
-            print(f" - {idx + 1}) {os.path.basename(fpath)}")
+        print_menu("\nSettings Templates:", (os.path.basename(fpath) for fpath in template_files))
         
         tpl_choice = get_input("Choose a settings template (number) or 'n' for none:", 
                               options=[str(i+1) for i in range(len(template_files))] + ['n'])
@@ -237,25 +451,19 @@ def main():
         if tpl_choice == 'n':
             selected_settings = {}
         else:
-            with open(template_files[int(tpl_choice) - 1], 'r') as f:
-                selected_settings = json.load(f)
+            selected_settings = load_template(template_files[int(tpl_choice) - 1])
 
     # 7. Dynamic Barcode Detection
     if samples and all('barcode_i7' in s for s in samples):
-        barcodes = []
-        for s in samples:
-            b = s.get('barcode_i7', '')
-            # Extract number from NB01, BC01, etc.
-            if b and (b.startswith('NB') or b.startswith('BC')):
-                try:
-                    barcodes.append(int(b[2:]))
-                except ValueError:
-                    pass
+        # Extract number from NB01, BC01, etc.
+        barcodes = [n for n in (barcode_number(s['barcode_i7'] or '') for s in samples) if n is not None]
         
         if barcodes:
             barcodes.sort()
-            # If they are contiguous, use range, else list
-            if len(barcodes) > 1 and all(barcodes[i] == barcodes[i-1] + 1 for i in range(1, len(barcodes))):
+            # If they are contiguous, use range, else list. Sorted and free of repeats, they are
+            # contiguous exactly when the first and last are len - 1 apart.
+            n = len(barcodes)
+            if n > 1 and barcodes[-1] - barcodes[0] == n - 1 and len(set(barcodes)) == n:
                 barcode_range = f"{barcodes[0]}-{barcodes[-1]}"
             else:
                 barcode_range = ",".join(map(str, barcodes))
@@ -265,61 +473,54 @@ def main():
             selected_settings['barcodingEnabled'] = True
 
     # 8. Confirm and Start
-    print(f"\nReady to start run '{run_name}' on {selected_pos['name']} using kit {selected_kit['code']}.")
-    print("Parameters:")
-    print(f" - Samples: {len(samples)}")
-    print(f" - Sample Sheet: {filepath}")
+    summary = [
+        f"\nReady to start run '{run_name}' on {selected_pos['name']} using kit {selected_kit['code']}.",
+        "Parameters:",
+        f" - Samples: {len(samples)}",
+        f" - Sample Sheet: {filepath}",
+    ]
     if selected_settings.get('customBarcodesSelection'):
-        print(f" - Barcodes: {selected_settings['customBarcodesSelection']}")
+        summary.append(f" - Barcodes: {selected_settings['customBarcodesSelection']}")
+    print("\n".join(summary))
     
     confirm = get_input("Please type 'Y' to confirm and start the run, or anything else to abort.")
     
     if confirm.upper() == 'Y':
         print("\nStarting run...")
         if args.mock:
-             minknow.start_run(
-                position_name=selected_pos['name'],
-                protocol_id="MOCK_PROTOCOL",
-                sample_sheet_path=filepath,
-                run_name=run_name,
-                settings=selected_settings,
-                samples=samples,
-                kit=selected_kit['code']
-            )
+            selected_proto = "MOCK_PROTOCOL"
         else:
-             # Real implementation: Get protocol from settings or let user choose
-             selected_proto = selected_settings.get('script', {}).get('identifier')
-             
-             if not selected_proto:
-                 print("Fetching available protocols...")
-                 protocols = minknow.list_protocols(selected_pos['name'])
-                 if not protocols:
-                     print("No protocols found for this position.")
-                     sys.exit(1)
-                 
-                 print(f"\nFound {len(protocols)} protocols:")
-                 for idx, p in enumerate(protocols):
-                     print(f" - {idx + 1}) {p}")
-                 
-                 proto_choice = get_input("Please choose a protocol (number) or 'q' to quit:", 
-                                         options=[str(i+1) for i in range(len(protocols))] + ['q'])
-                 
-                 if proto_choice == 'q':
-                     sys.exit(0)
-                 
-                 selected_proto = protocols[int(proto_choice) - 1]
-             else:
-                 print(f"Using protocol from template: {selected_proto}")
-             
-             minknow.start_run(
-                position_name=selected_pos['name'],
-                protocol_id=selected_proto,
-                sample_sheet_path=filepath,
-                run_name=run_name,
-                settings=selected_settings,
-                samples=samples,
-                kit=selected_kit['code']
-            )
+            # Real implementation: Get protocol from settings or let user choose
+            selected_proto = selected_settings.get('script', {}).get('identifier')
+            
+            if not selected_proto:
+                print("Fetching available protocols...")
+                protocols = protocols_future.result()
+                if not protocols:
+                    print("No protocols found for this position.")
+                    sys.exit(1)
+                
+                print_menu(f"\nFound {len(protocols)} protocols:", protocols)
+                
+                proto_choice = get_input("Please choose a protocol (number) or 'q' to quit:", 
+                                        options=[str(i+1) for i in range(len(protocols))] + ['q'])
+                
+                if proto_choice == 'q':
+                    sys.exit(0)
+                
+                selected_proto = protocols[int(proto_choice) - 1]
+            else:
+                print(f"Using protocol from template: {selected_proto}")
+        
+        minknow.start_run(
+            position_name=selected_pos['name'],
+            protocol_id=selected_proto,
+            sample_sheet_path=filepath,
+            run_name=run_name,
+            settings=selected_settings,
+            samples=samples,
+            kit=selected_kit['code']
+        )
         print("Run successfully started!")
     else:
         print("Aborted.")
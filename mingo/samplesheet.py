@@ -1,18 +1,53 @@
 
 import csv
 import io
-from typing import List, Dict
+import re
+from typing import List, Dict, Optional, TextIO
+
+# Prefixes of native (NB) and rapid (BC) barcodes
+_BC_PREFIXES = frozenset({"NB", "BC"})
+# Sample sheet barcode -> number and MinKNOW name for the 96-barcode kits, e.g. NB01/BC01 -> 1, barcode01
+_BARCODE_NUMBERS = {f"{p}{i:02d}": i for p in _BC_PREFIXES for i in range(1, 97)}
+_BARCODE_NAMES = {b: f"barcode{i:02d}" for b, i in _BARCODE_NUMBERS.items()}
+# Anything else that still looks like a barcode, e.g. NB7 or BC120
+_BARCODE_RE = re.compile(r'^(?:NB|BC)(\d+)$')
+
+def barcode_number(barcode_i7: str) -> Optional[int]:
+    """
+    Get the number of an NB##/BC## barcode, or None if it is not one.
+    """
+    number = _BARCODE_NUMBERS.get(barcode_i7)
+    if number is None:
+        match = _BARCODE_RE.match(barcode_i7)
+        if match:
+            number = int(match.group(1))
+    return number
+
+def barcode_name(barcode_i7: str, fallback: str = '') -> str:
+    """
+    Map an NB##/BC## barcode to its MinKNOW name (barcode##). Other NB/BC values are kept as they are;
+    anything else gives the fallback.
+    """
+    name = _BARCODE_NAMES.get(barcode_i7)
+    if name is not None:
+        return name
+    number = barcode_number(barcode_i7)
+    if number is not None:
+        return f"barcode{number:02d}"
+    if barcode_i7[:2] in _BC_PREFIXES:
+        return barcode_i7
+    return fallback
 
 class SampleSheetGenerator:
     def __init__(self):
-        self.headers = [
+        self.headers = (
             "flow_cell_id", "position_id", "sample_id", "experiment_id",
             "flow_cell_product_code", "kit", "alias", "type", "barcode",
             "cntn_cf_fk_barcode_i7", "cntn_id", "cntn_cf_taxon",
             "cntn_cf_genomeSizeMb", "cntn_cf_gcContent", "cntn_cf_orderName",
             "cntn_cf_stockConcentration", "cntn_cf_stockConcentration_unit",
             "cntn_cf_isUrgent", "cntn_cf_lowMaterial"
-        ]
+        )
 
     def generate(self, 
                  run_metadata: Dict, 
@@ -24,64 +59,47 @@ class SampleSheetGenerator:
         """
         Generate a CSV sample sheet string.
         """
-        output = io.StringIO()
-        writer = csv.DictWriter(output, fieldnames=self.headers)
-        writer.writeheader()
+        output = io.StringIO(newline='')
+        self.generate_to(output, run_metadata, samples, flow_cell_id, position_id, kit, flow_cell_product_code)
+        return output.getvalue()
 
-        experiment_id = run_metadata.get('xprn_name', 'Unknown_Run')
+    def generate_to(self,
+                    fp: TextIO,
+                    run_metadata: Dict,
+                    samples: List[Dict],
+                    flow_cell_id: str,
+                    position_id: str,
+                    kit: str,
+                    flow_cell_product_code: str = "FLO-PRO114"):
+        """
+        Write a CSV sample sheet straight to a text file object (opened with newline='').
+        """
+        writer = csv.writer(fp)
+        writer.writerow(self.headers)
 
-        for sample in samples:
-            # Map SLIMS Content fields to Sample Sheet columns
-            # This mapping assumes 'columns' in the entity response or direct fields.
-            # SLIMS entities usually have a 'columns' list or key-value pairs depending on the fetch.
-            # We'll assume the entity dict represents the record values.
-            
-            # Helper to safely get value from nested structures if needed, 
-            # but usually 'entity' is a flat dict of fields in simplified views, 
-            # or we need to extract from 'columns'.
-            # Based on slims.py, we expect a dictionary of field_name -> value.
-            
-            # Note: sample_id is often left blank in the example, alias is populated.
-            
-            # Extract barcode info collected during tracing
-            barcode_i7 = sample.get('barcode_i7', '')
-            barcode_name = ''
-            if barcode_i7.startswith('NB'):
-                try:
-                    idx = int(barcode_i7[2:])
-                    barcode_name = f"barcode{idx:02d}"
-                except ValueError:
-                    barcode_name = barcode_i7
-            elif barcode_i7.startswith('BC'):
-                try:
-                    idx = int(barcode_i7[2:])
-                    barcode_name = f"barcode{idx:02d}"
-                except ValueError:
-                    barcode_name = barcode_i7
-            else:
-                barcode_name = sample.get('cntn_barCode', '')
+        experiment_id = run_metadata.get('xprn_name', 'Unknown_Run')
 
-            row = {
-                "flow_cell_id": flow_cell_id,
-                "position_id": position_id,
-                "sample_id": "", # Intentionally empty as per example
-                "experiment_id": experiment_id,
-                "flow_cell_product_code": flow_cell_product_code,
-                "kit": kit,
-                "alias": sample.get('cntn_id', ''), 
-                "type": "test_sample", 
-                "barcode": barcode_name,
-                "cntn_cf_fk_barcode_i7": barcode_i7,
-                "cntn_id": sample.get('cntn_id', ''),
-                "cntn_cf_taxon": sample.get('cntn_cf_taxon', ''),
-                "cntn_cf_genomeSizeMb": sample.get('cntn_cf_genomeSizeMb', ''),
-                "cntn_cf_gcContent": sample.get('cntn_cf_gcContent', ''),
-                "cntn_cf_orderName": sample.get('cntn_cf_orderName', ''),
-                "cntn_cf_stockConcentration": sample.get('cntn_cf_stockConcentration', ''),
-                "cntn_cf_stockConcentration_unit": sample.get('cntn_cf_stockConcentration_unit', ''),
-                "cntn_cf_isUrgent": str(sample.get('cntn_cf_isUrgent', 'false')).lower(),
-                "cntn_cf_lowMaterial": str(sample.get('cntn_cf_lowMaterial', 'false')).lower(),
-            }
-            writer.writerow(row)
+        # Rows are built in header order, starting with the columns shared by every sample.
+        # sample_id is intentionally empty as per example; alias is populated.
+        prefix = (flow_cell_id, position_id, "", experiment_id, flow_cell_product_code, kit)
 
-        return output.getvalue()
+        # Samples are flat dicts of SLIMS field name -> value (see slims.py), with barcode info
+        # collected during tracing.
+        writer.writerows(
+            prefix + (
+                sample.get('cntn_id', ''),
+                "test_sample",
+                barcode_name(sample.get('barcode_i7') or '', sample.get('cntn_barCode', '')),
+                sample.get('barcode_i7', ''),
+                sample.get('cntn_id', ''),
+                sample.get('cntn_cf_taxon', ''),
+                sample.get('cntn_cf_genomeSizeMb', ''),
+                sample.get('cntn_cf_gcContent', ''),
+                sample.get('cntn_cf_orderName', ''),
+                sample.get('cntn_cf_stockConcentration', ''),
+                sample.get('cntn_cf_stockConcentration_unit', ''),
+                str(sample.get('cntn_cf_isUrgent', 'false')).lower(),
+                str(sample.get('cntn_cf_lowMaterial', 'false')).lower(),
+            )
+            for sample in samples
+        )
@@ -1,11 +1,73 @@
 
+import json
 import os
 import requests
 import logging
-from typing import List, Dict, Optional
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from requests.adapters import HTTPAdapter
+from typing import List, Dict, Iterator, Optional, Tuple
+from urllib3.util.retry import Retry
+
+# orjson is optional: it decodes the (often large) SLIMS responses and encodes searches several times faster
+try:
+    from orjson import dumps as _dumps, loads as _loads
+except ImportError:
+    from json import loads as _loads
+
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj).encode()
 
 logger = logging.getLogger(__name__)
 
+# Keep-alive connections held open to the SLIMS host, enough for concurrent callers
+POOL_MAXSIZE = 32
+# Concurrent requests per fan-out (steps of a run, inputs of the steps, ...); kept below POOL_MAXSIZE
+MAX_WORKERS = 8
+# How long (seconds) the 'ONT Sequencing' template pks are reused; templates change very rarely
+TEMPLATE_TTL = 300.0
+# Content items per batched request (pk lists in the URL, or 'or' criteria)
+BATCH_SIZE = 100
+# Records per page when reading advanced search results, bounding the size of each response
+PAGE_SIZE = 500
+# How many relations deep ingredients are traced
+MAX_TRACE_DEPTH = 5
+# Content types that we consider "Original Content", where tracing stops
+ORIGINAL_CONTENT_TYPES = frozenset({'DNA', 'Pure strain', 'Strain aliquot', 'DNA samples'})
+# Headers for requests whose body is already serialized JSON
+JSON_HEADERS = {'Content-Type': 'application/json'}
+# Retry idempotent requests that hit a gateway error or a dropped connection
+RETRY = Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504], raise_on_status=False)
+
+@lru_cache(maxsize=8)
+def _open_runs_payload(template_pks: Tuple[int, ...]) -> bytes:
+    """
+    Serialized search for runs of the given templates that are neither completed nor cancelled.
+    Template pks rarely change, so the same bytes are sent on every poll.
+    """
+    # Note: We use the 'or' structure for multiple templates to be safe
+    template_filters = [{"fieldName": "xprn_fk_experimentTemplate", "operator": "equals", "value": tpk} for tpk in template_pks]
+    run_criteria = {
+        "operator": "and",
+        "criteria": [
+            {"fieldName": "xprn_completed", "operator": "equals", "value": False},
+            {"fieldName": "xprn_cancelled", "operator": "equals", "value": False},
+            {"operator": "or", "criteria": template_filters}
+        ]
+    }
+    return _dumps({"criteria": run_criteria})
+
+class _TraceCaches:
+    """
+    Memo tables for tracing during one fetch_run_details* call.
+    Each call gets its own, so concurrent lookups on a shared client never see each other's tables.
+    """
+    def __init__(self):
+        self.content: Dict[int, Optional[Dict]] = {}
+        self.relations: Dict[int, List[int]] = {}
+        self.trace: Dict[Tuple[int, int], List[Tuple[Dict, Dict]]] = {}
+
 class SlimsClient:
     def __init__(self, url: str, user: str, password: str):
         self.url = url.rstrip('/')
@@ -13,20 +75,82 @@ class SlimsClient:
             self.url = self.url[:-5]
         self.auth = (user, password)
         self.headers = {'Content-Type': 'application/json'}
+        # One session for all requests, so they share pooled connections instead of each doing a TLS handshake
+        self.session = requests.Session()
+        self.session.auth = self.auth
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE, max_retries=RETRY)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # (fetch time, pks) of the 'ONT Sequencing' experiment templates
+        self._template_cache = (0.0, [])
+        # (endpoint, request body) -> (validator headers, parsed response) for conditional polling
+        self._validator_cache: Dict[Tuple[str, bytes], Tuple[Dict[str, str], Dict]] = {}
+
+    def close(self):
+        self.session.close()
 
-    def _get(self, endpoint: str, **kwargs) -> Dict:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _get(self, endpoint: str, conditional: bool = False, **kwargs) -> Dict:
+        """
+        GET an endpoint and parse the JSON response.
+        With conditional=True the request revalidates the last response for the same endpoint and body
+        (If-None-Match / If-Modified-Since), and a 304 Not Modified reuses it without re-parsing.
+        Servers that send no ETag or Last-Modified just get a normal request each time.
+        """
         full_url = f"{self.url}/rest/{endpoint}"
         logger.debug(f"GET {full_url} with kwargs {kwargs}")
-        response = requests.get(full_url, auth=self.auth, headers=self.headers, **kwargs)
+        key = cached = None
+        if conditional:
+            key = (endpoint, kwargs.get('data') or _dumps(kwargs.get('json')))
+            cached = self._validator_cache.get(key)
+            if cached:
+                kwargs['headers'] = {**kwargs.get('headers', {}), **cached[0]}
+        response = self.session.get(full_url, **kwargs)
+        if cached and response.status_code == 304:
+            return cached[1]
         response.raise_for_status()
-        return response.json()
+        parsed = _loads(response.content)
+        if key:
+            validators = {}
+            if response.headers.get('ETag'):
+                validators['If-None-Match'] = response.headers['ETag']
+            if response.headers.get('Last-Modified'):
+                validators['If-Modified-Since'] = response.headers['Last-Modified']
+            if validators:
+                self._validator_cache[key] = (validators, parsed)
+            else:
+                self._validator_cache.pop(key, None)
+        return parsed
 
     def _post(self, endpoint: str, data: Dict) -> Dict:
         full_url = f"{self.url}/rest/{endpoint}"
         logger.debug(f"POST {full_url} with data {data}")
-        response = requests.post(full_url, auth=self.auth, headers=self.headers, json=data)
+        response = self.session.post(full_url, json=data)
         response.raise_for_status()
-        return response.json()
+        return _loads(response.content)
+
+    def _iter_advanced(self, table: str, criteria: Dict, sort_by: str) -> Iterator[Dict]:
+        """
+        Yield the flattened records matching an advanced search, fetched a page at a time,
+        so large results are never held in memory as one response.
+        sort_by is a unique field (the table's pk column) giving the pages a stable order,
+        so no record is skipped or repeated between them.
+        """
+        start = 0
+        while True:
+            body = {"criteria": criteria, "sortBy": [sort_by], "startRow": start, "endRow": start + PAGE_SIZE}
+            entities = self._get(f"{table}/advanced", json=body).get('entities', [])
+            yield from map(self._flatten_entity, entities)
+            # Advance by what was returned, whether or not SLIMS treats endRow as inclusive
+            if len(entities) < PAGE_SIZE:
+                return
+            start += len(entities)
 
     def _flatten_entity(self, entity: Dict) -> Dict:
         """
@@ -34,16 +158,18 @@ class SlimsClient:
         Includes display values for foreign keys with a '_display' suffix.
         """
         flat = {'pk': entity.get('pk')}
-        for col in entity.get('columns', []):
+        for col in entity.get('columns') or ():
             name = col['name']
             flat[name] = col.get('value')
-            if 'displayValue' in col and col['displayValue'] is not None:
-                flat[f"{name}_display"] = col['displayValue']
+            display_value = col.get('displayValue')
+            if display_value is not None:
+                flat[name + '_display'] = display_value
         return flat
 
     def fetch_queued_runs(self) -> List[Dict]:
         """
         Fetch runs that are ready to start and belong to the 'ONT Sequencing' protocol.
+        Raises requests.exceptions.RequestException if SLIMS can't be read.
         """
         # 1. Find the "ONT Sequencing" templates
         template_criteria = {
@@ -53,131 +179,264 @@ class SlimsClient:
                 "value": "ONT Sequencing"
             }
         }
-        try:
-            templates = self._get("ExperimentTemplate/advanced", json=template_criteria).get('entities', [])
+        fetched_at, template_pks = self._template_cache
+        if not template_pks or time.monotonic() - fetched_at > TEMPLATE_TTL:
+            templates = self._get("ExperimentTemplate/advanced", conditional=True, json=template_criteria).get('entities', [])
             template_pks = [t.get('pk') for t in templates]
+            self._template_cache = (time.monotonic(), template_pks)
+        
+        if not template_pks:
+            logger.warning("No 'ONT Sequencing' templates found.")
+            return []
+
+        # 2. Find runs that are not completed/cancelled for these templates
+        runs_resp = self._get(
+            "ExperimentRun/advanced", conditional=True,
+            data=_open_runs_payload(tuple(template_pks)), headers=JSON_HEADERS,
+        )
+        all_potential_runs = list(map(self._flatten_entity, runs_resp.get('entities', [])))
+        
+        if not all_potential_runs:
+            return []
             
-            if not template_pks:
-                logger.warning("No 'ONT Sequencing' templates found.")
-                return []
-
-            # 2. Fetch runs for these templates that are 'Ready'
-            template_criteria = []
-            # 2. Find runs that are not completed/cancelled for these templates
-            # Note: We use the 'or' structure for multiple templates to be safe
-            template_filters = [{"fieldName": "xprn_fk_experimentTemplate", "operator": "equals", "value": tpk} for tpk in template_pks]
-            
-            run_criteria = {
-                "operator": "and",
+        # 3. Filter for runs that have at least one non-DONE step
+        # We can do this by fetching all steps for these runs in one query and checking statuses
+        steps_by_run = self._fetch_steps_by_run([run['pk'] for run in all_potential_runs])
+
+        queued_runs = []
+        for run in all_potential_runs:
+            steps = steps_by_run[run['pk']]
+            # If there are no steps, it's probably new/queued
+            # If there are steps, at least one must be NOT DONE
+            if not steps or any(s.get('xprs_status') != 'DONE' for s in steps):
+                queued_runs.append(run)
+        
+        # Sort by name/create date (newest first)
+        queued_runs.sort(key=lambda x: x.get('xprn_createdOn', 0), reverse=True)
+        return queued_runs
+
+    def invalidate_template_cache(self):
+        """
+        Forget the cached 'ONT Sequencing' template pks, e.g. after templates were edited in SLIMS.
+        """
+        self._template_cache = (0.0, [])
+
+    def _fetch_steps_by_run(self, run_pks: List[int]) -> Dict[int, List[Dict]]:
+        """
+        Fetch the steps of several runs, BATCH_SIZE runs per search, grouped by run pk
+        (runs without steps map to []).
+        """
+        steps_by_run = {pk: [] for pk in run_pks}
+        for i in range(0, len(run_pks), BATCH_SIZE):
+            # SLIMS has no 'in' operator, so match any of the runs with an 'or' of equals
+            step_criteria = {
+                "operator": "or",
                 "criteria": [
-                    {"fieldName": "xprn_completed", "operator": "equals", "value": False},
-                    {"fieldName": "xprn_cancelled", "operator": "equals", "value": False},
-                    {"operator": "or", "criteria": template_filters}
+                    {"fieldName": "xprs_fk_experimentRun", "operator": "equals", "value": pk}
+                    for pk in run_pks[i:i + BATCH_SIZE]
                 ]
             }
-            
-            runs_resp = self._get("ExperimentRun/advanced", json={"criteria": run_criteria})
-            all_potential_runs = [self._flatten_entity(e) for e in runs_resp.get('entities', [])]
-            
-            if not all_potential_runs:
-                return []
-                
-            # 3. Filter for runs that have at least one non-DONE step
-            # We can do this by fetching all steps for these runs and checking statuses
-            # For efficiency in a real environment, we'd batch this.
-            queued_runs = []
-            for run in all_potential_runs:
-                step_criteria = {
-                    "fieldName": "xprs_fk_experimentRun",
-                    "operator": "equals",
-                    "value": run['pk']
+            for step in self._iter_advanced("ExperimentRunStep", step_criteria, "xprs_pk"):
+                if step.get('xprs_fk_experimentRun') in steps_by_run:
+                    steps_by_run[step['xprs_fk_experimentRun']].append(step)
+        return steps_by_run
+
+    def _get_content(self, caches: _TraceCaches, content_pk: int) -> Optional[Dict]:
+        """
+        Fetch a flattened content record, reusing it if this lookup already fetched it.
+        """
+        if content_pk in caches.content:
+            return caches.content[content_pk]
+        entities = self._get(f"Content/{content_pk}").get('entities', [])
+        content = self._flatten_entity(entities[0]) if entities else None
+        caches.content[content_pk] = content
+        return content
+
+    def _get_relations(self, caches: _TraceCaches, content_pk: int) -> List[int]:
+        """
+        Get the pks of the content a content item was made from, reusing a prefetched answer if there is one.
+        """
+        if content_pk in caches.relations:
+            return caches.relations[content_pk]
+        criteria = {
+            "fieldName": "corl_fk_to",
+            "operator": "equals",
+            "value": content_pk
+        }
+        from_pks = [r.get('corl_fk_from') for r in self._iter_advanced("ContentRelation", criteria, "corl_pk")]
+        caches.relations[content_pk] = from_pks
+        return from_pks
+
+    def _prefetch_ingredients(self, caches: _TraceCaches, content_pks: List[int]):
+        """
+        Fill the content and relation caches for tracing, one level of the ingredient tree at a time,
+        so each level costs a few batched requests rather than one or two per content item.
+        Anything that fails to prefetch is fetched one by one while tracing instead.
+        """
+        frontier = list(dict.fromkeys(content_pks))
+        for _ in range(MAX_TRACE_DEPTH + 1):
+            missing = [pk for pk in frontier if pk not in caches.content]
+            for i in range(0, len(missing), BATCH_SIZE):
+                chunk = missing[i:i + BATCH_SIZE]
+                try:
+                    found = {c['pk']: c for c in self.fetch_content_by_pk(chunk)}
+                except requests.exceptions.RequestException as e:
+                    logger.debug(f"Batched content fetch failed, falling back to single fetches: {e}")
+                    continue
+                for pk in chunk:
+                    caches.content[pk] = found.get(pk)
+
+            # Only intermediate content has ingredients worth following
+            intermediates = [
+                pk for pk in frontier
+                if caches.content.get(pk) is not None
+                and caches.content[pk].get('cntp_name') not in ORIGINAL_CONTENT_TYPES
+                and pk not in caches.relations
+            ]
+            next_frontier = []
+            for i in range(0, len(intermediates), BATCH_SIZE):
+                chunk = intermediates[i:i + BATCH_SIZE]
+                # SLIMS has no 'in' operator, so match any of the items with an 'or' of equals
+                criteria = {
+                    "operator": "or",
+                    "criteria": [{"fieldName": "corl_fk_to", "operator": "equals", "value": pk} for pk in chunk]
                 }
-                steps_resp = self._get("ExperimentRunStep/advanced", json={"criteria": step_criteria})
-                steps = [self._flatten_entity(s) for s in steps_resp.get('entities', [])]
-                
-                # If there are no steps, it's probably new/queued
-                # If there are steps, at least one must be NOT DONE
-                if not steps or any(s.get('xprs_status') != 'DONE' for s in steps):
-                    queued_runs.append(run)
-            
-            # Sort by name/create date (newest first)
-            queued_runs.sort(key=lambda x: x.get('xprn_createdOn', 0), reverse=True)
-            return queued_runs
-            
-        except Exception as e:
-            print(f"Error fetching runs from SLIMS: {e}")
-            return []
+                relations = {pk: [] for pk in chunk}
+                try:
+                    for r in self._iter_advanced("ContentRelation", criteria, "corl_pk"):
+                        if r.get('corl_fk_to') in relations:
+                            relations[r['corl_fk_to']].append(r.get('corl_fk_from'))
+                except requests.exceptions.RequestException as e:
+                    logger.debug(f"Batched relation fetch failed, falling back to single fetches: {e}")
+                    continue
+                caches.relations.update(relations)
+                next_frontier.extend(pk for from_pks in relations.values() for pk in from_pks if pk)
+
+            frontier = list(dict.fromkeys(next_frontier))
+            if not frontier:
+                break
 
-    def _trace_ingredients(self, content_pk: int, depth: int = 0, metadata: Dict = None) -> List[Dict]:
+    def _trace_ingredients(
+        self, content_pk: int, depth: int = 0, metadata: Dict = None, caches: Optional[_TraceCaches] = None
+    ) -> List[Dict]:
         """
-        Recursively trace ingredients of a content item via ContentRelation.
+        Trace ingredients of a content item via ContentRelation.
         Stops at 'DNA' or 'Pure strain' or 'Strain aliquot' types or after max depth.
         Metadata from intermediate steps (like barcodes from DNA Library) is passed down.
+        Traces are memoized per content item in caches, so samples sharing a pooled library are only walked once.
         """
-        if metadata is None:
-            metadata = {}
-            
-        if depth > 5: # Safety break
-            return []
+        traced = self._traced(caches or _TraceCaches(), content_pk, depth)
+        # Merge collected metadata into the original content records; the deepest library wins
+        return [{**content, **(metadata or {}), **collected} for content, collected in traced]
+
+    def _trace_node(self, caches: _TraceCaches, content_pk: int, depth: int):
+        """
+        Look at a single content item during a trace.
+        Returns (content, collected metadata, ingredient pks), with ingredient pks None when the trace
+        stops here, or None when the item leads nowhere.
+        """
+        if depth > MAX_TRACE_DEPTH: # Safety break
+            return None
             
         try:
-            content_resp = self._get(f"Content/{content_pk}")
-            entities = content_resp.get('entities', [])
-            if not entities:
-                return []
-            content = self._flatten_entity(entities[0])
+            content = self._get_content(caches, content_pk)
+            if content is None:
+                return None
         except Exception:
-            return []
+            return None
 
         cntp = content.get('cntp_name')
+        collected = {}
         
         # If this is a DNA Library, it might have barcode info
         if cntp == 'DNA Library':
             # Capture barcode info to pass down
             if content.get('cntn_cf_fk_barcode_i7_display'):
-                metadata['barcode_i7'] = content['cntn_cf_fk_barcode_i7_display']
+                collected['barcode_i7'] = content['cntn_cf_fk_barcode_i7_display']
             if content.get('cntn_cf_barcodeAdapterSet'):
-                metadata['barcode_adapter'] = content['cntn_cf_barcodeAdapterSet']
+                collected['barcode_adapter'] = content['cntn_cf_barcodeAdapterSet']
 
         # Target types that we consider "Original Content"
-        if cntp in ['DNA', 'Pure strain', 'Strain aliquot', 'DNA samples']:
-            # Merge collected metadata into the original content record
-            content.update(metadata)
-            return [content]
+        if cntp in ORIGINAL_CONTENT_TYPES:
+            return content, collected, None
             
         # Otherwise, find relations (ingredients)
-        criteria = {
-            "criteria": {
-                "fieldName": "corl_fk_to",
-                "operator": "equals",
-                "value": content_pk
-            }
-        }
         try:
-            rels_resp = self._get("ContentRelation/advanced", json=criteria)
-            rels = rels_resp.get('entities', [])
-            
-            ingredients = []
-            for r_entity in rels:
-                r = self._flatten_entity(r_entity)
-                from_pk = r.get('corl_fk_from')
-                if from_pk:
-                    # Pass a copy of metadata to avoid cross-contamination
-                    ingredients.extend(self._trace_ingredients(from_pk, depth + 1, metadata.copy()))
-            
-            # If it's a library but no ingredients found, just return the library itself as fallback
-            if not ingredients and cntp in ['DNA Library', 'Library pool']:
-                content.update(metadata)
-                return [content]
-            
-            return ingredients
+            return content, collected, [from_pk for from_pk in self._get_relations(caches, content_pk) if from_pk]
         except Exception:
-            content.update(metadata)
-            return [content]
+            return content, collected, None
+
+    def _traced(self, caches: _TraceCaches, content_pk: int, depth: int) -> List[Tuple[Dict, Dict]]:
+        """
+        Trace a content item to (original content, metadata collected from libraries on the way) pairs.
+        Independent of any metadata passed from above, so the result can be shared between callers.
+        Walks the ingredient tree with an explicit stack, finishing each item once all of its ingredients are traced.
+        """
+        traces = caches.trace
+        pending = {}
+        stack = [(content_pk, depth)]
+        while stack:
+            key = stack[-1]
+            if key in traces:
+                stack.pop()
+                continue
+            if key not in pending:
+                node = self._trace_node(caches, *key)
+                if node is None or node[2] is None:
+                    traces[key] = [node[:2]] if node else []
+                    stack.pop()
+                    continue
+                pending[key] = node
+                children = [(from_pk, key[1] + 1) for from_pk in node[2]]
+                stack.extend(child for child in children if child not in traces)
+                if any(child not in traces for child in children):
+                    continue
+
+            content, collected, from_pks = pending.pop(key)
+            # Metadata found further down overrides this library's
+            ingredients = [
+                (ing, {**collected, **below})
+                for from_pk in from_pks
+                for ing, below in traces[(from_pk, key[1] + 1)]
+            ]
+            # If it's a library but no ingredients found, just return the library itself as fallback
+            if not ingredients and content.get('cntp_name') in ('DNA Library', 'Library pool'):
+                ingredients = [(content, collected)]
+            traces[key] = ingredients
+            stack.pop()
+        return traces[(content_pk, depth)]
+
+    def _collect_inputs(self, caches: _TraceCaches, steps: List[Dict]) -> List[Dict]:
+        """
+        Trace the input content of the given run steps back to the original samples, without duplicates.
+        """
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            # Fetch linked content (input samples) for each step
+            inputs_resps = executor.map(lambda step: self._get(f"eln/content/input/{step.get('pk')}"), steps)
+            input_pks = [
+                self._flatten_entity(input_entity)['pk']
+                for inputs_resp in inputs_resps
+                for input_entity in inputs_resp.get('entities', [])
+            ]
+            # Fetch the ingredient trees level by level, then trace each input from the caches;
+            # map keeps the results in input order
+            self._prefetch_ingredients(caches, input_pks)
+            traced = list(executor.map(lambda pk: self._trace_ingredients(pk, caches=caches), input_pks))
+
+        original_samples = []
+        seen_pks = set()
+        for ingredients in traced:
+            for ing in ingredients:
+                if ing['pk'] not in seen_pks:
+                    original_samples.append(ing)
+                    seen_pks.add(ing['pk'])
+        return original_samples
 
     def fetch_run_details(self, run_pk: int) -> Dict:
         """
         Fetch details for a specific run, including linked original content (samples).
+        Raises requests.exceptions.RequestException if the run or its samples can't be read,
+        rather than returning a run with no samples.
         """
         # Fetch the run record itself
         run_record = self._flatten_entity(self._get(f"ExperimentRun/{run_pk}").get('entities', [])[0])
@@ -191,34 +450,38 @@ class SlimsClient:
             }
         }
         
-        original_samples = []
-        seen_pks = set()
-        
-        try:
-            steps_resp = self._get("ExperimentRunStep/advanced", json=step_criteria)
-            steps = steps_resp.get('entities', [])
-            
-            for step in steps:
-                step_pk = step.get('pk')
-                # 2. Fetch linked content (input samples) for each step
-                inputs_resp = self._get(f"eln/content/input/{step_pk}")
-                for input_entity in inputs_resp.get('entities', []):
-                    input_flat = self._flatten_entity(input_entity)
-                    # 3. Recursively trace ingredients for each input
-                    ingredients = self._trace_ingredients(input_flat['pk'])
-                    for ing in ingredients:
-                        if ing['pk'] not in seen_pks:
-                            original_samples.append(ing)
-                            seen_pks.add(ing['pk'])
-                    
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Failed to fetch steps/samples for run {run_pk}: {e}")
+        steps_resp = self._get("ExperimentRunStep/advanced", json=step_criteria)
+        # 2. Trace the inputs of each step
+        original_samples = self._collect_inputs(_TraceCaches(), steps_resp.get('entities', []))
         
         return {
             "run": run_record,
             "inputs": original_samples
         }
 
+    def fetch_run_details_batch(self, run_pks: List[int]) -> Dict[int, Dict]:
+        """
+        Fetch details for several runs, keyed by run pk, as fetch_run_details would return them.
+        The run records and their steps are each fetched BATCH_SIZE runs per request.
+        Raises requests.exceptions.RequestException like fetch_run_details.
+        """
+        details = {}
+        for i in range(0, len(run_pks), BATCH_SIZE):
+            pks_str = ",".join(map(str, run_pks[i:i + BATCH_SIZE]))
+            for entity in self._get(f"ExperimentRun/{pks_str}").get('entities', []):
+                run = self._flatten_entity(entity)
+                details[run['pk']] = {"run": run, "inputs": []}
+        if not details:
+            return {}
+
+        steps_by_run = self._fetch_steps_by_run(list(details))
+        # Runs often share pooled libraries, so they share one set of memo tables
+        caches = _TraceCaches()
+        for run_pk, steps in steps_by_run.items():
+            details[run_pk]["inputs"] = self._collect_inputs(caches, steps)
+
+        return details
+
     def fetch_content_by_pk(self, pks: List[int]) -> List[Dict]:
         """
         Fetch content records by primary keys.
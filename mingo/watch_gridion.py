@@ -1,19 +1,53 @@
 #!/bin/env python3
 
 import argparse
+import asyncio
 import csv
+import grpc
 import minknow_api
 import sys
+from concurrent.futures import Executor, ThreadPoolExecutor
 from minknow_api.manager import Manager
 from minknow_api import protocol_pb2
+from minknow_api.protocol_service import ProtocolService
 from slack_sdk.webhook import WebhookClient
 from google.protobuf.json_format import (
     MessageToDict,
 )
 from os import environ
+from typing import Dict, Optional, Tuple
 
 SLACK_HOOK = environ['SLACK_HOOK']
 
+# One webhook client for the life of the service instead of one per notification
+_SLACK = WebhookClient(SLACK_HOOK)
+
+# Slack message text, image and alt text for each notification phase
+_BLOCK_TEMPLATES = {
+    "starting": (
+        "Run started with: {}",
+        "https://pbs.twimg.com/tweet_video_thumb/GbfXKIxawAA0e96.jpg",
+        "yeeeeaaaahhh",
+    ),
+    "finished": (
+        "Run finished with: {}",
+        "https://pbs.twimg.com/tweet_video_thumb/GbfXKIxawAA0e96.jpg",
+        "yeeeeaaaahhh",
+    ),
+    "error": (
+        "Run errored with: {}",
+        "https://encrypted-tbn0.gstatic.com/images?q=tbn:ANd9GcREgSDZuZBRAm0ASuRQrpvb91kTrFsbfQDgqw&s",
+        "yeeeeaaaahhh",
+    ),
+}
+
+# Maximum number of Slack notifications in flight at once (threads in the Slack pool)
+SLACK_CONCURRENCY = 4
+
+# Keepalive ping interval (ms) for the watch channels, so a stream that is quiet for hours of
+# sequencing isn't silently dropped; no more often than gRPC servers accept by default
+KEEPALIVE_TIME_MS = 300000
+
 ERROR_STATES = {
     protocol_pb2.PROTOCOL_FINISHED_WITH_ERROR: "Error",
     protocol_pb2.PROTOCOL_FINISHED_WITH_DEVICE_ERROR: "Device Error",
@@ -64,82 +98,103 @@ def main():
     manager = Manager(
         host=args.host, port=args.port, developer_api_token=args.api_token
     )
-    for pos in manager.flow_cell_positions():
-        if pos.running:
-            with pos.connect() as connection:
-                protocol = connection.protocol
-                device = connection.device
-                for msg in protocol.watch_current_protocol_run():
-                    dmsg: Dict = MessageToDict(msg)
-                    print("\n")
-                    print("--------------------------------")
-                    print("\n") 
-                    print(dmsg)
-                    print(dmsg.get("state"), dmsg.get("device",{}).get("device_id"),
-                          dmsg.get("run_id"), dmsg.get("protocol_id"), dmsg.get("phase_history",{}).get("phase"))
-                    if msg.state in ERROR_STATES:
-                        phase = "error"
-                        report = ERROR_STATES[msg.state]
-                    elif msg.state in OK_STATES:
-                        if msg.state == protocol_pb2.PROTOCOL_RUNNING:
-                            phase = "starting"
-                        else:
-                            phase = "finished"
-                        report = OK_STATES[msg.state]
-                    else:
-                        continue
-                    slackit(phase, report)
+    asyncio.run(watch_positions(manager.flow_cell_positions()))
+
+async def watch_positions(positions):
+    """
+    Watch every running position concurrently, one task per position.
+    Each position serves RPC on its own port, so each task holds one connection for as long as it watches.
+    """
+    running = [pos for pos in positions if pos.running]
+    if not running:
+        return
+    # Each blocking stream holds a thread for as long as it is watched, so streams get a thread per
+    # position and Slack posts get their own pool, rather than competing for the default executor
+    with ThreadPoolExecutor(max_workers=len(running), thread_name_prefix="watch") as streams, \
+            ThreadPoolExecutor(max_workers=SLACK_CONCURRENCY, thread_name_prefix="slack") as slack:
+        results = await asyncio.gather(
+            *(watch_position(pos, streams, slack) for pos in running),
+            return_exceptions=True,
+        )
+    for pos, result in zip(running, results):
+        if isinstance(result, Exception):
+            print(f"Stopped watching {pos.name}: {result}")
+
+async def watch_position(pos, streams: Executor, slack: Executor):
+    """
+    Relay protocol state changes on one position to Slack.
+
+    minknow_api only exposes blocking streams, so each message is pulled on a
+    thread from streams and the event loop stays free for the other positions.
+    """
+    loop = asyncio.get_running_loop()
+    notifications = set()
+    with watch_channel(pos) as channel:
+        stream = iter(ProtocolService(channel).watch_current_protocol_run())
+        while (msg := await loop.run_in_executor(streams, next, stream, None)) is not None:
+            dmsg: Dict = MessageToDict(msg)
+            print("\n")
+            print("--------------------------------")
+            print("\n") 
+            print(dmsg)
+            print(dmsg.get("state"), dmsg.get("device",{}).get("device_id"),
+                  dmsg.get("run_id"), dmsg.get("protocol_id"), dmsg.get("phase_history",{}).get("phase"))
+            notification = classify(msg)
+            if notification is None:
+                continue
+            # Post in the background so a slow webhook never delays the stream
+            task = asyncio.create_task(notify(slack, *notification))
+            notifications.add(task)
+            task.add_done_callback(notifications.discard)
+    if notifications:
+        await asyncio.gather(*notifications)
+
+def watch_channel(pos) -> grpc.Channel:
+    """
+    Open a channel to a position for watching, as pos.connect() would but with keepalive pings.
+    Only this channel gets them; minknow_api's own options are left alone for other connections.
+    """
+    port = pos.description.rpc_ports.secure
+    if port == 0:
+        raise RuntimeError(f"Invalid port for connection to '{pos.name}': '{port}'")
+    return grpc.secure_channel(
+        f"{pos.host}:{port}",
+        credentials=pos.credentials,
+        options=[*minknow_api.GRPC_CHANNEL_OPTIONS, ("grpc.keepalive_time_ms", KEEPALIVE_TIME_MS)],
+    )
+
+def classify(msg) -> Optional[Tuple[str, str]]:
+    """
+    Map a protocol run message to a (phase, report) pair, or None if it is not worth reporting.
+    """
+    if msg.state in ERROR_STATES:
+        return "error", ERROR_STATES[msg.state]
+    if msg.state in OK_STATES:
+        phase = "starting" if msg.state == protocol_pb2.PROTOCOL_RUNNING else "finished"
+        return phase, OK_STATES[msg.state]
+    return None
+
+async def notify(slack: Executor, phase, report):
+    """
+    Send a Slack notification on the slack pool without blocking the event loop.
+    """
+    try:
+        await asyncio.get_running_loop().run_in_executor(slack, slackit, phase, report)
+    except Exception as e:
+        print(f"Failed to notify Slack ({phase}: {report}): {e}")
+
+def _make_blocks(phase, msg):
+    text, image_url, alt_text = _BLOCK_TEMPLATES[phase]
+    return [
+        {
+            "type": "section",
+            "text": {"type": "mrkdwn", "text": text.format(msg)},
+            "accessory": {"type": "image", "image_url": image_url, "alt_text": alt_text},
+        }
+    ]
 
 def slackit(phase, msg):
-    webhook = WebhookClient(SLACK_HOOK)
-    match phase:
-        case "starting":
-            blocks = [
-                {
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": f"Run started with: {msg}"
-                    },
-                    "accessory": {
-                        "type": "image",
-                        "image_url": "https://pbs.twimg.com/tweet_video_thumb/GbfXKIxawAA0e96.jpg",
-                        "alt_text": "yeeeeaaaahhh"
-                    }
-                }
-            ]
-        case "finished":
-            blocks = [
-                {
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": f"Run finished with: {msg}"
-                    },
-                    "accessory": {
-                        "type": "image",
-                        "image_url": "https://pbs.twimg.com/tweet_video_thumb/GbfXKIxawAA0e96.jpg",
-                        "alt_text": "yeeeeaaaahhh"
-                    }
-                }
-            ]
-
-        case "error":
-            blocks = [
-                {
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": f"Run errored with: {msg}"
-                    },
-                    "accessory": {
-                        "type": "image",
-                        "image_url": "https://encrypted-tbn0.gstatic.com/images?q=tbn:ANd9GcREgSDZuZBRAm0ASuRQrpvb91kTrFsbfQDgqw&s",
-                        "alt_text": "yeeeeaaaahhh"
-                    }
-                }
-            ]
-    response = webhook.send(text=msg, blocks=blocks)
+    response = _SLACK.send(text=msg, blocks=_make_blocks(phase, msg))
     assert response.status_code == 200
     assert response.body == "ok"
 
@@ -0,0 +1,258 @@
+
+import threading
+import time
+import unittest
+import grpc
+from unittest.mock import MagicMock, patch
+from minknow_api import protocol_pb2
+from mingo.minknow_utils import MinKNOWClient, FAST_POLL, SLOW_POLL, resolve_barcoding_kits, to_protocol_settings
+
+def make_position(name, flow_cell_id="FC001"):
+    pos = MagicMock()
+    pos.name = name
+    connection = pos.connect.return_value
+    connection.device.get_flow_cell_info.return_value.flow_cell_id = flow_cell_id
+    connection.device.get_flow_cell_info.return_value.product_code = "FLO-PRO114"
+    connection.protocol.list_protocols.return_value.protocols = [MagicMock(identifier="proto_a")]
+    return pos
+
+class TestMinKNOWClient(unittest.TestCase):
+    def setUp(self):
+        patcher = patch('mingo.minknow_utils.Manager')
+        self.mock_manager_cls = patcher.start()
+        self.addCleanup(patcher.stop)
+        pool_patcher = patch.dict('mingo.minknow_utils._MANAGER_POOL', clear=True)
+        pool_patcher.start()
+        self.addCleanup(pool_patcher.stop)
+        self.pos = make_position("1A")
+        self.manager = self.mock_manager_cls.return_value
+        self.manager.flow_cell_positions.return_value = [self.pos]
+        self.client = MinKNOWClient()
+
+    def test_reuses_positions_and_connections(self):
+        self.client.get_positions()
+        self.assertEqual(self.client.list_protocols("1A"), ["proto_a"])
+        self.assertEqual(self.manager.flow_cell_positions.call_count, 1)
+        self.assertEqual(self.pos.connect.call_count, 1)
+
+    def test_shares_manager_between_clients(self):
+        self.assertIs(MinKNOWClient().manager, self.client.manager)
+        MinKNOWClient(host="other")
+        self.assertEqual(self.mock_manager_cls.call_count, 2)
+
+    def test_caches_protocol_list(self):
+        protocol = self.pos.connect.return_value.protocol
+        self.client.list_protocols("1A")
+        self.client.list_protocols("1A")
+        self.assertEqual(protocol.list_protocols.call_count, 1)
+        self.client.invalidate_protocols("1A")
+        self.client.list_protocols("1A")
+        self.assertEqual(protocol.list_protocols.call_count, 2)
+
+    def test_snapshot_position_uses_one_connection(self):
+        snapshot = self.client.snapshot_position("1A")
+        self.assertEqual(snapshot["flow_cell_id"], "FC001")
+        self.assertEqual(snapshot["protocols"], ["proto_a"])
+        self.assertEqual(self.pos.connect.call_count, 1)
+
+    def test_drops_connection_after_failure(self):
+        self.pos.connect.return_value.protocol.list_protocols.side_effect = RuntimeError("gone")
+        self.assertEqual(self.client.list_protocols("1A"), [])
+        self.pos.connect.return_value.protocol.list_protocols.side_effect = None
+        self.assertEqual(self.client.list_protocols("1A"), ["proto_a"])
+        self.assertEqual(self.pos.connect.call_count, 2)
+
+    @patch('mingo.minknow_utils.protocols.start_protocol')
+    def test_start_run_maps_barcodes(self, mock_start_protocol):
+        samples = [
+            {"cntn_id": "S1", "barcode_i7": "NB01"},
+            {"cntn_id": "S2", "barcode_i7": "BC7"},
+            {"cntn_id": "S3", "barcode_i7": "custom"},
+        ]
+        self.client.start_run("1A", "proto_a", "sheet.csv", run_name="RUN", samples=samples)
+        barcode_info = mock_start_protocol.call_args.kwargs["barcode_info"]
+        self.assertEqual(
+            [(b.alias, b.barcode_name) for b in barcode_info],
+            [("S1", "barcode01"), ("S2", "barcode07"), ("S3", "custom")],
+        )
+
+    @patch('mingo.minknow_utils.protocols.start_protocol')
+    def test_start_runs_on_several_positions(self, mock_start_protocol):
+        self.manager.flow_cell_positions.return_value = [self.pos, make_position("1B")]
+        mock_start_protocol.side_effect = lambda connection, **kwargs: f"run-{kwargs['experiment_group']}"
+        results = self.client.start_runs_sync([
+            {"position_name": "1A", "protocol_id": "proto_a", "sample_sheet_path": "a.csv", "run_name": "A"},
+            {"position_name": "1B", "protocol_id": "proto_a", "sample_sheet_path": "b.csv", "run_name": "B"},
+            {"position_name": "9Z", "protocol_id": "proto_a", "sample_sheet_path": "c.csv", "run_name": "C"},
+        ])
+        self.assertEqual(results[:2], ["run-A", "run-B"])
+        self.assertIsInstance(results[2], KeyError)
+
+    def test_next_poll_delay_follows_run_phase(self):
+        protocol = self.pos.connect.return_value.protocol
+        protocol._pb = protocol_pb2
+        run_info = protocol_pb2.ProtocolRunInfo(
+            state=protocol_pb2.PROTOCOL_RUNNING, phase=protocol_pb2.PHASE_MUX_SCAN
+        )
+        protocol._stub.get_run_info.future.return_value.result.return_value = run_info
+        self.client.get_positions()
+        self.assertEqual(self.client.next_poll_delay("1A"), FAST_POLL)
+
+        run_info.phase = protocol_pb2.PHASE_SEQUENCING
+        self.client.get_positions()
+        self.assertEqual(self.client.next_poll_delay("1A"), SLOW_POLL)
+
+    def test_skips_run_info_for_finished_run(self):
+        protocol = self.pos.connect.return_value.protocol
+        protocol._pb = protocol_pb2
+        protocol._stub.get_run_info.future.return_value.result.return_value = protocol_pb2.ProtocolRunInfo(
+            state=protocol_pb2.PROTOCOL_COMPLETED
+        )
+        self.assertEqual(self.client.get_positions()[0]["status"], "Ready")
+        self.assertEqual(self.client.get_positions()[0]["status"], "Ready")
+        self.assertEqual(protocol._stub.get_run_info.future.call_count, 1)
+
+        # A different flow cell means the cached state no longer applies
+        self.pos.connect.return_value.device.get_flow_cell_info.return_value.flow_cell_id = "FC009"
+        self.client.get_positions()
+        self.assertEqual(protocol._stub.get_run_info.future.call_count, 2)
+
+    @patch('mingo.minknow_utils.FlowCellPosition')
+    def test_watching_serves_pushed_state(self, mock_position_cls):
+        stop = threading.Event()
+        self.addCleanup(stop.set)
+
+        def stream(*messages):
+            yield from messages
+            stop.wait(5)
+
+        mock_position_cls.return_value = self.pos
+        self.pos.running = True
+        self.manager.rpc.watch_flow_cell_positions.side_effect = lambda: stream(
+            MagicMock(additions=[MagicMock()], changes=[], removals=[])
+        )
+        connection = self.pos.connect.return_value
+        connection.protocol._pb = protocol_pb2
+        connection.protocol.watch_current_protocol_run.side_effect = lambda: stream(
+            protocol_pb2.ProtocolRunInfo(state=protocol_pb2.PROTOCOL_RUNNING)
+        )
+        connection.device.stream_flow_cell_info.side_effect = lambda: stream(
+            MagicMock(flow_cell_id="FC002", product_code="FLO-PRO114")
+        )
+
+        self.client.start_watching()
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            positions = self.client._watched_positions()
+            if positions and positions[0]["status"] == "Running":
+                break
+            time.sleep(0.01)
+
+        positions = self.client.get_positions()
+        self.assertEqual(positions[0]["flow_cell_id"], "FC002")
+        self.assertTrue(positions[0]["running"])
+        connection.device.get_flow_cell_info.assert_not_called()
+
+    @patch('mingo.minknow_utils.FlowCellPosition')
+    def test_watching_completes_with_idle_and_stopped_positions(self, mock_position_cls):
+        stop = threading.Event()
+        self.addCleanup(stop.set)
+
+        def stream(*messages):
+            yield from messages
+            stop.wait(5)
+
+        class NoRun(grpc.RpcError):
+            pass
+
+        # 1A is running but has never run a protocol, so its run stream stays silent; 1B is not running
+        self.pos.running = True
+        stopped = make_position("1B")
+        stopped.running = False
+        mock_position_cls.side_effect = [self.pos, stopped]
+        self.manager.rpc.watch_flow_cell_positions.side_effect = lambda: stream(
+            MagicMock(additions=[MagicMock(), MagicMock()], changes=[], removals=[])
+        )
+        connection = self.pos.connect.return_value
+        connection.protocol.get_run_info.side_effect = NoRun()
+        connection.protocol.watch_current_protocol_run.side_effect = lambda: stream()
+        connection.device.stream_flow_cell_info.side_effect = lambda: stream(
+            MagicMock(flow_cell_id="FC002", product_code="FLO-PRO114")
+        )
+
+        self.client.start_watching()
+        deadline = time.monotonic() + 5
+        while self.client._watched_positions() is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        statuses = {p["name"]: p["status"] for p in self.client._watched_positions()}
+        self.assertEqual(statuses, {"1A": "Ready", "1B": "Error/Offline"})
+        stopped.connect.assert_not_called()
+
+    @patch('mingo.minknow_utils.WATCH_RETRY_INITIAL', 0.01)
+    @patch('mingo.minknow_utils.FlowCellPosition')
+    def test_watching_resubscribes_after_stream_breaks(self, mock_position_cls):
+        stop = threading.Event()
+        self.addCleanup(stop.set)
+
+        def stream(*messages):
+            yield from messages
+            stop.wait(5)
+
+        def broken():
+            raise grpc.RpcError("connection reset")
+            yield
+
+        mock_position_cls.return_value = self.pos
+        self.pos.running = True
+        self.manager.rpc.watch_flow_cell_positions.side_effect = lambda: stream(
+            MagicMock(additions=[MagicMock()], changes=[], removals=[])
+        )
+        connection = self.pos.connect.return_value
+        connection.protocol.get_run_info.return_value = protocol_pb2.ProtocolRunInfo(
+            state=protocol_pb2.PROTOCOL_COMPLETED
+        )
+        attempts = iter([broken, lambda: stream(protocol_pb2.ProtocolRunInfo(state=protocol_pb2.PROTOCOL_RUNNING))])
+        connection.protocol.watch_current_protocol_run.side_effect = lambda: next(attempts)()
+        connection.device.stream_flow_cell_info.side_effect = lambda: stream(
+            MagicMock(flow_cell_id="FC002", product_code="FLO-PRO114")
+        )
+
+        self.client.start_watching()
+        deadline = time.monotonic() + 5
+        positions = None
+        while time.monotonic() < deadline:
+            positions = self.client._watched_positions()
+            if positions and positions[0]["status"] == "Running":
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(positions[0]["status"], "Running")
+        self.assertEqual(self.pos.connect.call_count, 2)
+
+class TestProtocolSettings(unittest.TestCase):
+    def test_to_protocol_settings(self):
+        settings = to_protocol_settings({"flag": True, "count": 3, "ratio": 0.5, "name": "x"})
+        self.assertEqual(settings["flag"].WhichOneof("protocol_setting_value"), "bool_value")
+        self.assertEqual(settings["count"].integer_value, 3)
+        self.assertEqual(settings["ratio"].float_value, 0.5)
+        self.assertEqual(settings["name"].string_value, "x")
+        with self.assertRaises(ValueError):
+            to_protocol_settings({"bad": None})
+
+class TestResolveBarcodingKits(unittest.TestCase):
+    def test_priority(self):
+        self.assertEqual(resolve_barcoding_kits("CLI", "SAMPLE", ("EXP",), "TAG"), ("CLI",))
+        self.assertEqual(resolve_barcoding_kits(None, "SAMPLE", ("EXP",), "TAG"), ("SAMPLE",))
+        self.assertEqual(resolve_barcoding_kits(None, None, ("EXP",), "TAG"), ("EXP",))
+        self.assertEqual(resolve_barcoding_kits(None, None, (), "TAG"), ("TAG",))
+        self.assertEqual(resolve_barcoding_kits(None, None, (), None), ())
+
+    def test_logs_every_choice(self):
+        with self.assertLogs('mingo.minknow_utils', level='INFO') as logs:
+            resolve_barcoding_kits("CLI", None, (), None)
+            resolve_barcoding_kits("CLI", None, (), None)
+        self.assertEqual(logs.output, ["INFO:mingo.minknow_utils:Using explicitly selected barcoding kit: CLI"] * 2)
+
+if __name__ == '__main__':
+    unittest.main()
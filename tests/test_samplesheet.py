@@ -36,5 +36,16 @@ class TestSampleSheetGenerator(unittest.TestCase):
         self.assertEqual(row['cntn_cf_isUrgent'], "true")
         self.assertEqual(row['cntn_cf_taxon'], "E. coli")
 
+    def test_barcode_names(self):
+        samples = [
+            {"cntn_id": "S1", "barcode_i7": "NB01"},
+            {"cntn_id": "S2", "barcode_i7": "BC7"},
+            {"cntn_id": "S3", "barcode_i7": "NBX"},
+            {"cntn_id": "S4", "cntn_barCode": "custom"},
+        ]
+        csv_output = self.generator.generate({}, samples, "FC", "P1", "KIT")
+        rows = list(csv.DictReader(io.StringIO(csv_output)))
+        self.assertEqual([r['barcode'] for r in rows], ["barcode01", "barcode07", "NBX", "custom"])
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,42 +1,303 @@
 
+import ast
+import json
+import requests
 import unittest
 from unittest.mock import MagicMock, patch
-from mingo.slims import SlimsClient
+from mingo import slims
+from mingo.slims import MAX_TRACE_DEPTH, SlimsClient, _TraceCaches
+
+def column(name, value):
+    return {"name": name, "value": value}
+
+def serve(mock_get, responses):
+    """
+    Answer each mocked GET from the responses keyed by endpoint, as SLIMS would.
+    A response keyed by table name alone is a function of (endpoint, request kwargs) serving any of its
+    endpoints, and a response that is an exception fails the request.
+    """
+    def get(url, **kwargs):
+        endpoint = url.split("/rest/", 1)[1]
+        payload = responses.get(endpoint) or responses[endpoint.split("/", 1)[0]]
+        if callable(payload):
+            payload = payload(endpoint, kwargs)
+        response = MagicMock(status_code=200, headers={})
+        if isinstance(payload, Exception):
+            response.raise_for_status.side_effect = payload
+        else:
+            response.content = json.dumps(payload).encode()
+        return response
+
+    mock_get.side_effect = get
+
+def content(pk, content_type, barcode=None, adapter=None):
+    columns = [column("cntp_name", content_type), column("cntn_id", f"C{pk}")]
+    if barcode:
+        columns.append({"name": "cntn_cf_fk_barcode_i7", "value": 1, "displayValue": barcode})
+    if adapter:
+        columns.append(column("cntn_cf_barcodeAdapterSet", adapter))
+    return {"pk": pk, "columns": columns}
+
+def run_with_inputs(input_pks, contents, relations):
+    """
+    Responses for run 1 with one step whose inputs are input_pks, over a graph of content records
+    and the pks each one was made from. A None in relations makes that item's relation lookups fail.
+    """
+    def get_content(endpoint, kwargs):
+        pks = map(int, endpoint.split("/", 1)[1].split(","))
+        return {"entities": [contents[pk] for pk in pks if pk in contents]}
+
+    def get_relations(endpoint, kwargs):
+        criteria = kwargs["json"]["criteria"]
+        to_pks = [c["value"] for c in criteria["criteria"]] if "criteria" in criteria else [criteria["value"]]
+        if any(relations.get(pk, []) is None for pk in to_pks):
+            return requests.exceptions.HTTPError("500 Server Error")
+        return {"entities": [
+            {"pk": 0, "columns": [column("corl_fk_to", to_pk), column("corl_fk_from", from_pk)]}
+            for to_pk in to_pks for from_pk in relations.get(to_pk, [])
+        ]}
+
+    return {
+        "ExperimentRun/1": {"entities": [{"pk": 1, "columns": [column("xprn_name", "TestRun")]}]},
+        "ExperimentRunStep/advanced": {"entities": [{"pk": 11, "columns": [column("xprs_fk_experimentRun", 1)]}]},
+        "eln/content/input/11": {"entities": [{"pk": pk} for pk in input_pks]},
+        "Content": get_content,
+        "ContentRelation/advanced": get_relations,
+    }
 
 class TestSlimsClient(unittest.TestCase):
     def setUp(self):
         self.client = SlimsClient("http://slims.example.com", "user", "pass")
 
-    @patch('mingo.slims.requests.get')
+    def test_single_client_definition(self):
+        with open(slims.__file__) as f:
+            tree = ast.parse(f.read())
+        clients = [n for n in ast.walk(tree) if isinstance(n, ast.ClassDef) and n.name == "SlimsClient"]
+        self.assertEqual(len(clients), 1)
+
+    @patch('mingo.slims.requests.Session.get')
     def test_fetch_queued_runs(self, mock_get):
-        mock_response = MagicMock()
-        mock_response.json.return_value = {
-            "entities": [{"pk": 1, "xprn_status": "Ready", "xprn_name": "TestRun"}]
-        }
-        mock_response.raise_for_status.return_value = None
-        mock_get.return_value = mock_response
+        serve(mock_get, {
+            "ExperimentTemplate/advanced": {"entities": [{"pk": 7}]},
+            "ExperimentRun/advanced": {"entities": [
+                {"pk": 1, "columns": [column("xprn_name", "TestRun")]},
+                {"pk": 2, "columns": [column("xprn_name", "DoneRun")]},
+            ]},
+            "ExperimentRunStep/advanced": {"entities": [
+                {"pk": 11, "columns": [column("xprs_fk_experimentRun", 1), column("xprs_status", "PENDING")]},
+                {"pk": 21, "columns": [column("xprs_fk_experimentRun", 2), column("xprs_status", "DONE")]},
+            ]},
+        })
 
         runs = self.client.fetch_queued_runs()
         self.assertEqual(len(runs), 1)
         self.assertEqual(runs[0]['xprn_name'], "TestRun")
+        run_search = next(c for c in mock_get.call_args_list if c.args[0].endswith("ExperimentRun/advanced"))
+        templates = json.loads(run_search.kwargs["data"])["criteria"]["criteria"][2]["criteria"]
+        self.assertEqual([t["value"] for t in templates], [7])
         
-    @patch('mingo.slims.requests.get')
+    @patch('mingo.slims.requests.Session.get')
+    def test_fetch_queued_runs_raises_when_slims_fails(self, mock_get):
+        serve(mock_get, {
+            "ExperimentTemplate/advanced": {"entities": [{"pk": 7}]},
+            "ExperimentRun/advanced": requests.exceptions.HTTPError("503 Service Unavailable"),
+        })
+        with self.assertRaises(requests.exceptions.HTTPError):
+            self.client.fetch_queued_runs()
+
+    @patch('mingo.slims.requests.Session.get')
     def test_fetch_run_details(self, mock_get):
-        # Mocking multiple calls: one for run info, one for inputs
-        mock_run_response = MagicMock()
-        mock_run_response.json.return_value = {"pk": 1, "xprn_name": "TestRun"}
-        
-        mock_inputs_response = MagicMock()
-        mock_inputs_response.json.return_value = {
-            "entities": [{"pk": 101, "cntn_id": "Sample1"}]
-        }
-        
-        mock_get.side_effect = [mock_run_response, mock_inputs_response]
+        serve(mock_get, {
+            "ExperimentRun/1": {"entities": [{"pk": 1, "columns": [column("xprn_name", "TestRun")]}]},
+            "ExperimentRunStep/advanced": {"entities": [
+                {"pk": 11, "columns": [column("xprs_fk_experimentRun", 1)]},
+            ]},
+            "eln/content/input/11": {"entities": [{"pk": 101}]},
+            "Content/101": {"entities": [
+                {"pk": 101, "columns": [column("cntn_id", "Sample1"), column("cntp_name", "DNA")]},
+            ]},
+        })
 
         details = self.client.fetch_run_details(1)
         self.assertEqual(details['run']['xprn_name'], "TestRun")
         self.assertEqual(len(details['inputs']), 1)
         self.assertEqual(details['inputs'][0]['cntn_id'], "Sample1")
 
+    @patch('mingo.slims.requests.Session.get')
+    def test_fetch_run_details_batch(self, mock_get):
+        serve(mock_get, {
+            "ExperimentRun/1,2": {"entities": [
+                {"pk": 1, "columns": [column("xprn_name", "RunA")]},
+                {"pk": 2, "columns": [column("xprn_name", "RunB")]},
+            ]},
+            "ExperimentRunStep/advanced": {"entities": [
+                {"pk": 11, "columns": [column("xprs_fk_experimentRun", 1)]},
+                {"pk": 21, "columns": [column("xprs_fk_experimentRun", 2)]},
+            ]},
+            "eln/content/input/11": {"entities": [{"pk": 101}]},
+            "eln/content/input/21": {"entities": []},
+            "Content/101": {"entities": [{"pk": 101, "columns": [column("cntp_name", "DNA")]}]},
+        })
+
+        details = self.client.fetch_run_details_batch([1, 2])
+        self.assertEqual(details[1]['run']['xprn_name'], "RunA")
+        self.assertEqual([i['pk'] for i in details[1]['inputs']], [101])
+        self.assertEqual(details[2]['inputs'], [])
+        # Within a batch, one request each for the runs and their steps
+        urls = [c.args[0] for c in mock_get.call_args_list]
+        self.assertEqual(sum(u.endswith("ExperimentRunStep/advanced") for u in urls), 1)
+
+    @patch('mingo.slims.BATCH_SIZE', 2)
+    @patch('mingo.slims.requests.Session.get')
+    def test_steps_are_searched_a_batch_of_runs_at_a_time(self, mock_get):
+        def steps(endpoint, kwargs):
+            run_pks = [c["value"] for c in kwargs["json"]["criteria"]["criteria"]]
+            return {"entities": [{"pk": pk * 10, "columns": [column("xprs_fk_experimentRun", pk)]} for pk in run_pks]}
+
+        serve(mock_get, {"ExperimentRunStep": steps})
+
+        steps_by_run = self.client._fetch_steps_by_run([1, 2, 3])
+        self.assertEqual({pk: [step["pk"] for step in run_steps] for pk, run_steps in steps_by_run.items()}, {1: [10], 2: [20], 3: [30]})
+        searched = [[c["value"] for c in call.kwargs["json"]["criteria"]["criteria"]] for call in mock_get.call_args_list]
+        self.assertEqual(searched, [[1, 2], [3]])
+        self.assertTrue(all(c.kwargs["json"]["sortBy"] == ["xprs_pk"] for c in mock_get.call_args_list))
+
+    @patch('mingo.slims.BATCH_SIZE', 2)
+    @patch('mingo.slims.requests.Session.get')
+    def test_runs_are_fetched_a_batch_at_a_time(self, mock_get):
+        def runs(endpoint, kwargs):
+            pks = map(int, endpoint.split("/", 1)[1].split(","))
+            return {"entities": [{"pk": pk, "columns": [column("xprn_name", f"Run{pk}")]} for pk in pks]}
+
+        serve(mock_get, {"ExperimentRun": runs, "ExperimentRunStep/advanced": {"entities": []}})
+
+        details = self.client.fetch_run_details_batch([1, 2, 3])
+        self.assertEqual({pk: d['run']['xprn_name'] for pk, d in details.items()}, {1: "Run1", 2: "Run2", 3: "Run3"})
+        urls = [c.args[0].split("/rest/", 1)[1] for c in mock_get.call_args_list]
+        self.assertEqual([u for u in urls if not u.endswith("/advanced")], ["ExperimentRun/1,2", "ExperimentRun/3"])
+
+    @patch('mingo.slims.requests.Session.get')
+    def test_unchanged_runs_are_revalidated(self, mock_get):
+        runs = {"entities": [{"pk": 1, "columns": [column("xprn_name", "TestRun")]}]}
+
+        def get(url, **kwargs):
+            endpoint = url.split("/rest/", 1)[1]
+            response = MagicMock(status_code=200, headers={})
+            if endpoint == "ExperimentTemplate/advanced":
+                response.content = json.dumps({"entities": [{"pk": 7}]}).encode()
+            elif endpoint == "ExperimentRunStep/advanced":
+                response.content = json.dumps({"entities": []}).encode()
+            elif kwargs.get("headers", {}).get("If-None-Match") == '"v1"':
+                response.status_code, response.content = 304, b""
+            else:
+                response.headers = {"ETag": '"v1"'}
+                response.content = json.dumps(runs).encode()
+            return response
+
+        mock_get.side_effect = get
+
+        first = self.client.fetch_queued_runs()
+        second = self.client.fetch_queued_runs()
+        self.assertEqual(first, second)
+        self.assertEqual(second[0]['xprn_name'], "TestRun")
+        run_searches = [c for c in mock_get.call_args_list if c.args[0].endswith("ExperimentRun/advanced")]
+        self.assertEqual(run_searches[-1].kwargs["headers"]["If-None-Match"], '"v1"')
+
+    @patch('mingo.slims.PAGE_SIZE', 2)
+    @patch('mingo.slims.requests.Session.get')
+    def test_relations_are_read_a_page_at_a_time(self, mock_get):
+        relations = [{"pk": pk, "columns": [column("corl_fk_from", pk)]} for pk in (1, 2, 3)]
+
+        def get(url, **kwargs):
+            response = MagicMock()
+            rows = relations[kwargs["json"]["startRow"]:kwargs["json"]["endRow"]]
+            response.content = json.dumps({"entities": rows}).encode()
+            return response
+
+        mock_get.side_effect = get
+
+        self.assertEqual(self.client._get_relations(_TraceCaches(), 9), [1, 2, 3])
+        self.assertEqual([c.kwargs["json"]["startRow"] for c in mock_get.call_args_list], [0, 2])
+        self.assertTrue(all(c.kwargs["json"]["sortBy"] == ["corl_pk"] for c in mock_get.call_args_list))
+
+    @patch('mingo.slims.requests.Session.get')
+    def test_template_pks_are_cached(self, mock_get):
+        mock_response = MagicMock()
+        mock_response.content = json.dumps({"entities": [{"pk": 7}]}).encode()
+        mock_get.return_value = mock_response
+
+        self.client.fetch_queued_runs()
+        self.client.fetch_queued_runs()
+        urls = [c.args[0] for c in mock_get.call_args_list]
+        self.assertEqual(sum(u.endswith("ExperimentTemplate/advanced") for u in urls), 1)
+
+        self.client.invalidate_template_cache()
+        self.client.fetch_queued_runs()
+        urls = [c.args[0] for c in mock_get.call_args_list]
+        self.assertEqual(sum(u.endswith("ExperimentTemplate/advanced") for u in urls), 2)
+
+class TestIngredientTracing(unittest.TestCase):
+    def setUp(self):
+        self.client = SlimsClient("http://slims.example.com", "user", "pass")
+        patcher = patch('mingo.slims.requests.Session.get')
+        self.mock_get = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def trace(self, input_pks, contents, relations):
+        serve(self.mock_get, run_with_inputs(input_pks, contents, relations))
+        return self.client.fetch_run_details(1)['inputs']
+
+    def requested(self, prefix):
+        return [c.args[0].split("/rest/", 1)[1] for c in self.mock_get.call_args_list
+                if c.args[0].split("/rest/", 1)[1].startswith(prefix)]
+
+    def test_shared_ingredients_are_traced_once(self):
+        # Two libraries in a pool, both made from the same extraction of one DNA sample
+        contents = {
+            100: content(100, "Library pool"),
+            200: content(200, "DNA Library", barcode="NB01"),
+            201: content(201, "DNA Library", barcode="NB02"),
+            250: content(250, "Extraction"),
+            300: content(300, "DNA"),
+        }
+        relations = {100: [200, 201], 200: [250], 201: [250], 250: [300]}
+        inputs = self.trace([100], contents, relations)
+        self.assertEqual([(i['pk'], i['barcode_i7']) for i in inputs], [(300, "NB01")])
+        # Each level of the tree is fetched in one batch, and the shared extraction only once
+        self.assertEqual(self.requested("Content/"), ["Content/100", "Content/200,201", "Content/250", "Content/300"])
+
+    def test_deepest_library_metadata_wins(self):
+        contents = {
+            200: content(200, "DNA Library", barcode="NB01", adapter="A1"),
+            210: content(210, "DNA Library", barcode="NB05"),
+            300: content(300, "DNA"),
+            301: content(301, "Pure strain"),
+        }
+        relations = {200: [210, 301], 210: [300]}
+        inputs = self.trace([200], contents, relations)
+        self.assertEqual(
+            [(i['pk'], i['barcode_i7'], i['barcode_adapter']) for i in inputs],
+            [(300, "NB05", "A1"), (301, "NB01", "A1")],
+        )
+
+    def test_stops_at_max_depth(self):
+        # A chain of intermediates, with original content one step deeper than tracing goes
+        chain = list(range(100, 100 + MAX_TRACE_DEPTH + 2))
+        contents = {pk: content(pk, "Extraction") for pk in chain[:-1]}
+        contents[chain[-1]] = content(chain[-1], "DNA")
+        relations = dict(zip(chain, ([pk] for pk in chain[1:])))
+        self.assertEqual(self.trace([chain[0]], contents, relations), [])
+        self.assertEqual([i['pk'] for i in self.trace([chain[1]], contents, relations)], [chain[-1]])
+
+    def test_library_stands_in_when_relations_fail(self):
+        contents = {
+            200: content(200, "DNA Library", barcode="NB01"),
+            201: content(201, "DNA Library", barcode="NB02"),
+            300: content(300, "DNA"),
+        }
+        relations = {200: None, 201: [300]}
+        inputs = self.trace([200, 201], contents, relations)
+        self.assertEqual([(i['pk'], i['barcode_i7']) for i in inputs], [(200, "NB01"), (300, "NB02")])
+
 if __name__ == '__main__':
     unittest.main()